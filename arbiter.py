@@ -2,13 +2,22 @@
 
 """ Проверка исполняемого файла задачи на тестах из заданной папки """
 
-import os, shutil, sys, time, logging, glob, re, datetime, subprocess, traceback
+import os, shutil, sys, time, logging, glob, re, datetime, subprocess, traceback, tempfile, cProfile, threading, socket
 from os.path import abspath, basename, split as pathsplit, join as pathjoin, isfile, isdir
 from argparse import ArgumentParser
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from ctypes import CDLL, c_char_p, c_uint, byref
 
 from multimeter._tasks import Task
+from multimeter._storage import BlobStore, load_manifest, test_files
+from multimeter._cluster import Coordinator, Connection, parse_address
+from multimeter._generated import TestCache, load_generated, DEFAULT_CACHE_SIZE as DEFAULT_GENERATED_CACHE_SIZE
+from multimeter._profile import PhaseProfiler
+from multimeter._languages import LANGUAGES, BuildCache, detect_language, COMPILE_TIMEOUT
+from multimeter._scheduler import MemoryScheduler, physical_memory
+from multimeter._verdicts import VerdictCache, DEFAULT_CACHE_SIZE, cached_file_hash
+from multimeter.helpers import file_hash, copy_and_hash, load_json, save_json, MANIFEST_FILENAME
 
 LOG_FILENAME = 'arbiter.log'
 DEFAULT_SOLUTION_MASK = 'Debug/*.exe'
@@ -16,9 +25,21 @@ INPUT_FILENAME  = 'putin1.txt'
 OUTPUT_FILENAME = 'putout.txt'
 ANSWER_FILENAME = 'putans.txt'
 TMPFILE_MASK    = 'put???.txt'
+STAGE_FILENAME  = 'putin1.stage'
+CACHE_DIRNAME   = '.cache'
+VERDICTS_FILENAME = 'verdicts.sqlite'
+BUILDS_DIRNAME  = 'builds'
+BLOBS_DIRNAME   = 'blobs'
+ADMISSION_DIRNAME = 'admission'
+GENERATED_DIRNAME = 'generated'
+DEFAULT_MEMORY_BUDGET = 4096     # Мб, если объем памяти машины узнать не удалось
+FIRST_RUN_TIMELIMIT = 3
+TOKEN_ENVIRONMENT = 'MULTIMETER_TOKEN'
+DEFAULT_WORKER_STORE_SIZE = 4096  # Мб
 
 cfg = {}
 invoker = None
+profiler = PhaseProfiler(enabled=False)
 
 
 class ArbiterError(Exception):
@@ -35,14 +56,15 @@ class PatchedTask(Task):
         global cfg
         return cfg['checker']
 
-    def check(self, answer_file=ANSWER_FILENAME):
+    @profiler.profiled('checker')
+    def check(self, answer_file=ANSWER_FILENAME, input_file=None, output_file=None):
         """ Проверка ответа участника """
         answer = ['FL', '']
         try:
             output = subprocess.check_output([
                 self.checker,
-                self.input_file,
-                self.output_file,
+                input_file or self.input_file,
+                output_file or self.output_file,
                 answer_file,
             ], stderr=subprocess.STDOUT)
             answer = ['OK', output]
@@ -86,6 +108,54 @@ def read_arguments():
                             type=str, help='каталог для записи результатов, по умолчанию рабочий')
         parser.add_argument('-s', '--solution', default=DEFAULT_SOLUTION_MASK,
                             type=str, help='исполняемый файл для тестирования, по умолчанию ищет в Debug в рабочем каталоге')
+        parser.add_argument('-l', '--language', default=None, choices=list(LANGUAGES),
+                            type=str, help='язык решения, по умолчанию определяется по расширению; '
+                                           'исходный текст компилируется арбитром')
+        parser.add_argument('-p', '--pipeline', action='store_true',
+                            help='конвейерная проверка: чекер и подготовка тестов работают во время запуска следующего теста')
+        parser.add_argument('--profile', nargs='?', const='phases', default=None, choices=('phases', 'cprofile'),
+                            help='замер времени этапов проверки, cprofile - дополнительно профиль cProfile')
+        parser.add_argument('--stress', nargs=2, default=None, metavar=('GENERATOR', 'REFERENCE'),
+                            type=str, help='стресс-тестирование решения: генератор тестов (получает номер '
+                                           'в аргументах, тест выводит в stdout) и эталонное решение')
+        parser.add_argument('--stress-count', default=1000,
+                            type=int, help='количество тестов стресс-тестирования, по умолчанию 1000')
+        parser.add_argument('-j', '--jobs', default=os.cpu_count() or 1,
+                            type=int, help='количество параллельных запусков при стресс-тестировании')
+        parser.add_argument('--coordinator', default=None, metavar='[HOST:]PORT',
+                            type=str, help='распределенная проверка: раздавать тесты рабочим процессам')
+        parser.add_argument('--shard-size', default=5,
+                            type=int, help='количество тестов в одном задании распределенной проверки')
+        parser.add_argument('--cluster-timeout', default=3600,
+                            type=float, help='предельное время распределенной проверки в секундах, '
+                                             'по умолчанию 3600, 0 - без ограничения')
+        parser.add_argument('--shard-retries', default=2,
+                            type=int, help='сколько раз повторять прерванное задание, по умолчанию 2')
+        parser.add_argument('--worker', default=None, metavar='HOST:PORT',
+                            type=str, help='работать рабочим процессом координатора распределенной проверки')
+        parser.add_argument('--token', default=os.environ.get(TOKEN_ENVIRONMENT),
+                            type=str, help=f'общий ключ координатора и рабочих процессов, '
+                                           f'по умолчанию из переменной окружения {TOKEN_ENVIRONMENT}')
+        parser.add_argument('--idle-exit', default=0,
+                            type=float, help='завершить рабочий процесс, если координатор недоступен '
+                                             'дольше заданного числа секунд, 0 - работать всегда')
+        parser.add_argument('--worker-store-size', default=DEFAULT_WORKER_STORE_SIZE,
+                            type=int, help=f'размер хранилища файлов рабочего процесса в Мб, '
+                                           f'по умолчанию {DEFAULT_WORKER_STORE_SIZE}')
+        parser.add_argument('--memory-budget', default=None,
+                            type=float, help='бюджет памяти в Мб для одновременных запусков, '
+                                             'по умолчанию вся оперативная память машины')
+        parser.add_argument('--memory-margin', default=64,
+                            type=float, help='запас памяти в Мб к лимиту каждого запуска, по умолчанию 64')
+        parser.add_argument('--generated-cache-size', default=DEFAULT_GENERATED_CACHE_SIZE,
+                            type=int, help=f'размер кэша сгенерированных тестов в Мб, '
+                                           f'по умолчанию {DEFAULT_GENERATED_CACHE_SIZE}')
+        parser.add_argument('--generate-jobs', default=1,
+                            type=int, help='количество параллельных фоновых генераций тестов, по умолчанию 1')
+        parser.add_argument('-c', '--cachedir', default=None,
+                            type=str, help=f'каталог для кэшей, по умолчанию {CACHE_DIRNAME} в каталоге арбитра')
+        parser.add_argument('--verdict-cache-size', default=DEFAULT_CACHE_SIZE,
+                            type=int, help='размер кэша вердиктов чекера, 0 - не использовать кэш')
         return vars(parser.parse_args())
     except Exception as error:
         logging.error(f'Не удалось прочесть аргументы командной строки: {error.args[0]}')
@@ -102,12 +172,13 @@ def check_writable(directory):
         logging.error(f'Не удалась попытка записи в {directory}-каталог "{cfg[directory]}"!!!')
         raise ArbiterError('FL') from None
 
+@profiler.profiled('check_dirs')
 def check_dirs():
     """ проверка наличия и доступности всех каталогов"""
     global cfg
     for _ in ('workdir', 'testdir', 'resultsdir'):
         base_dir = os.getcwd() if _=='workdir' else cfg['workdir']
-        directory = cfg[_] = pathjoin(base_dir, cfg[_])
+        directory = cfg[_] = abspath(pathjoin(base_dir, cfg[_]))
         if not isdir(directory):
             logging.error(f'Не удалось найти {_}-каталог "{directory}"!!!')
             raise ArbiterError('FL')
@@ -119,9 +190,6 @@ def check_dirs():
 
     try:
         os.chdir(cfg['testdir'])
-        if not glob.glob('./??'):
-            logging.error(f'Не удалось найти тесты в папке {cfg["testdir"]}, проверьте, что проект называется правильно')
-            raise ArbiterError('NT')
     except OSError as error:
         logging.error(f'Не удалось войти в каталог тестов: "{cfg["testdir"]}"!!!')
         raise ArbiterError('FL') from None
@@ -130,6 +198,55 @@ def check_dirs():
     check_writable('resultsdir')
     cfg['taskname'] = re.sub('[^A-Za-z0-9_.]', '' , basename(cfg['workdir']))
 
+@profiler.profiled('setup_generated_tests')
+def setup_generated_tests():
+    """ Тесты, заданные в task.json генератором и аргументами; ответы дает эталонное решение """
+    global cfg
+    config = load_json(pathjoin(cfg['workdir'], 'task.json'), {})
+    cfg['generated'] = OrderedDict()
+    if not isinstance(config, dict):
+        logging.error('task.json должен содержать объект с описанием задачи')
+        raise ArbiterError('FL')
+    reference = pathjoin(cfg['workdir'], str(config.get('reference', '')))
+    # Тесты арбитра не разделяются по подзадачам, поэтому имена должны быть уникальны
+    tests = set(basename(fn) for fn in glob.glob(pathjoin(cfg['testdir'], '??')))
+    tests.update(load_manifest(cfg['testdir']))
+    suites = config.get('test_suites', {})
+    if not isinstance(suites, dict):
+        logging.error('В task.json "test_suites" должно быть объектом "код подзадачи": описание')
+        raise ArbiterError('FL')
+    for suite_key, suite in suites.items():
+        try:
+            generated = load_generated(suite, cfg['workdir'], reference)
+        except ValueError as e:
+            logging.error(f'Неверное описание сгенерированных тестов подзадачи {suite_key} в task.json: {e}')
+            raise ArbiterError('FL') from None
+        for name, test in generated.items():
+            if name in tests or name in cfg['generated']:
+                logging.error(f'Сгенерированный тест {name} подзадачи {suite_key} повторяет имя другого теста')
+                raise ArbiterError('FL')
+            cfg['generated'][name] = test
+    if not cfg['generated']:
+        return
+    for program in set([reference] + [test.generator for test in cfg['generated'].values()]):
+        if not isfile(program):
+            logging.error(f'Не найдена программа для генерации тестов: {program}')
+            raise ArbiterError('FL')
+    # Фоновая генерация соблюдает бюджет памяти: генератор и эталон считаются запуском с лимитом задачи
+    memory_limit = make_task().memory_limit
+    cfg['test_cache'] = TestCache(pathjoin(cfg['cachedir'], GENERATED_DIRNAME), cfg['generated_cache_size'],
+                                  program_command, INPUT_FILENAME, OUTPUT_FILENAME,
+                                  lambda: cfg['scheduler'].admit(memory_limit, 'генерация тестов'))
+    logging.debug('СГЕНЕРИРОВАННЫЕ ТЕСТЫ: ' + ' '.join(cfg['generated']))
+
+def check_tests_exist():
+    """ Проверка наличия тестов """
+    global cfg
+    if not cfg['stress'] and not list_tests(cfg['testdir']):
+        logging.error(f'Не удалось найти тесты в папке {cfg["testdir"]}, проверьте, что проект называется правильно')
+        raise ArbiterError('NT')
+
+@profiler.profiled('check_solution_exists')
 def check_solution_exists():
     """ Проверка наличия файла решений """
     global cfg
@@ -152,6 +269,45 @@ def check_solution_exists():
     cfg['solution'] = solution
     logging.debug('НАЙДЕНО РЕШЕНИЕ: ' + cfg['solution'])
 
+def build_program(language, source):
+    """ Компиляция исходного текста через кэш сборок
+    Отказ компилятора (не запустился, не уложился во время) - отказ проверки FL, а не CE
+    :return: (успех компиляции, путь к результату либо сообщения компилятора)
+    """
+    global cfg
+    if 'build_cache' not in cfg:
+        cfg['build_cache'] = BuildCache(pathjoin(cfg['cachedir'], BUILDS_DIRNAME))
+    logging.debug(f'Компиляция {source} ({language.name})')
+    try:
+        return cfg['build_cache'].build(language, source)
+    except subprocess.TimeoutExpired:
+        logging.error(f'Компиляция {source} не завершилась за {COMPILE_TIMEOUT} с')
+    except (OSError, subprocess.SubprocessError) as e:
+        logging.error(f'Не удалось запустить компилятор {language.compiler} ({language.name}): {e}')
+    raise ArbiterError('FL')
+
+@profiler.profiled('compile_solution')
+def compile_solution():
+    """ Компиляция решения, если оно задано исходным текстом """
+    global cfg
+    language = detect_language(cfg['solution'], cfg['language'])
+    if language is None:
+        # Готовый исполняемый файл, собранный вне арбитра (build2.cmd)
+        cfg['language'], cfg['compilation'] = 'VisualCppLang', 'OK'
+        cfg['solution_cmd'] = [cfg['solution']]
+        return
+    cfg['language'], cfg['compilation'] = language.name, 'CE'
+    ok, result = build_program(language, cfg['solution'])
+    if not ok:
+        logging.error('Ошибка компиляции:')
+        logging.error(result.decode('utf-8', 'replace'))
+        raise ArbiterError('CE')
+    cfg['compilation'] = 'OK'
+    cfg['solution'] = result
+    cfg['solution_cmd'] = language.command(result)
+    logging.debug(f'РЕШЕНИЕ СКОМПИЛИРОВАНО: {result}')
+
+@profiler.profiled('get_known_checkers')
 def get_known_checkers():
     exe_mask = '*.exe' if sys.platform == 'win32' else '*'
     path_mask = pathjoin(cfg['checktoolsdir'], 'checkers', sys.platform, exe_mask)
@@ -169,6 +325,7 @@ def is_known_checker_name(fn):
     global cfg
     return os.path.splitext(basename(fn))[0] in cfg['known_checkers']
 
+@profiler.profiled('check_checker_exists')
 def check_checker_exists():
     """ Проверка наличия файла проверяющей программы """
     global cfg
@@ -198,9 +355,39 @@ def check_checker_exists():
         logging.error(f'    кандидаты: {candidates}')
         raise ArbiterError('FL')
 
+@profiler.profiled('setup_verdict_cache')
+def setup_verdict_cache():
+    """ Открытие кэша вердиктов чекера, при ошибке тестирование идет без кэша """
+    global cfg
+    cfg['verdict_cache'] = None
+    if cfg['verdict_cache_size'] <= 0:
+        return
+    filename = pathjoin(cfg['cachedir'], VERDICTS_FILENAME)
+    try:
+        if cfg.get('checker'):
+            cfg['checker_hash'] = file_hash(cfg['checker'])
+        cfg['verdict_cache'] = VerdictCache(filename, cfg['verdict_cache_size'])
+    except Exception as e:
+        logging.warning(f'Не удалось открыть кэш вердиктов {filename}: {e}')
+
+def setup_scheduler():
+    """ Допуск запусков по памяти, общий для всех процессов арбитра с тем же каталогом кэшей """
+    global cfg
+    budget = cfg['memory_budget'] or physical_memory() or DEFAULT_MEMORY_BUDGET
+    ledger_dir = pathjoin(cfg['cachedir'], ADMISSION_DIRNAME)
+    try:
+        cfg['scheduler'] = MemoryScheduler(budget, cfg['memory_margin'], ledger_dir)
+    except OSError as e:
+        logging.warning(f'Не удалось создать каталог учета памяти {ledger_dir}: {e}')
+        cfg['scheduler'] = MemoryScheduler(budget, cfg['memory_margin'])
+
+@profiler.profiled('check_invoker_loads')
 def check_invoker_loads():
     """ Проверка наличия invoker.dll """
     global cfg, invoker
+    if sys.platform != 'win32' or cfg['solution_cmd'] != [cfg['solution']]:
+        logging.debug('Решение запускается без invoker.dll')
+        return
     dllpath = abspath(pathjoin(cfg['checktoolsdir'], 'invoker.dll'))
     if not isfile(dllpath):
         logging.error(f'Библиотека для запуска решений invoker.DLL ({dllpath}) не найдена!')
@@ -212,6 +399,14 @@ def check_invoker_loads():
         logging.error(e)
         raise ArbiterError('FL') from None
 
+def list_tests(testdir):
+    """ Имена тестов каталога: файлы ??, тесты из манифеста хранилища и сгенерированные тесты """
+    tests = set(basename(fn) for fn in glob.glob(pathjoin(testdir, '??')))
+    tests.update(load_manifest(testdir))
+    tests.update(cfg.get('generated', {}))
+    return sorted(tests)
+
+@profiler.profiled('cleanup')
 def cleanup(task):
     """ Очистка старых выходных данных перед запуском """
     global cfg
@@ -226,9 +421,67 @@ def cleanup(task):
             logging.error('Не могу удалить временные файл(ы) теста: ' + filename)
             raise ArbiterError('FL') from None
 
+@profiler.profiled('check_answer')
+def check_answer(task, answer_file, input_hash, input_file=None, output_file=None):
+    """ Проверка ответа участника, одинаковый вывод на тесте проверяется чекером однократно """
+    global cfg
+    output_file = output_file or task.output_file
+    cache = cfg.get('verdict_cache')
+    if cache is None or not isfile(output_file):
+        return task.check(answer_file, input_file, output_file)
+    key = cache.key(cfg['checker_hash'], input_hash,
+                    cached_file_hash(answer_file), file_hash(output_file))
+    answer = cache.get(key)
+    if answer is not None:
+        logging.info('  Вердикт взят из кэша')
+        return answer
+    answer = task.check(answer_file, input_file, output_file)
+    cache.put(key, *answer)
+    return answer
+
+@profiler.profiled('subprocess')
+def execute_with_subprocess(task):
+    """ Запуск решения без invoker.dll: stdin - входной файл, stdout - выходной файл
+    Время - процессорное время процесса, память - пиковый объем резидентной памяти
+    """
+    global cfg
+    with open(task.input_file, 'rb') as stdin, open(task.output_file, 'wb') as stdout:
+        start = time.perf_counter()
+        try:
+            process = subprocess.Popen(cfg['solution_cmd'], stdin=stdin, stdout=stdout,
+                                       stderr=subprocess.DEVNULL)
+        except OSError:
+            return 'RE'
+        killer = threading.Timer(task.timeout, process.kill)
+        killer.start()
+        try:
+            if hasattr(os, 'wait4'):
+                _, status, usage = os.wait4(process.pid, 0)
+                process.returncode = os.waitstatus_to_exitcode(status)
+                cpu_time, memory = usage.ru_utime + usage.ru_stime, usage.ru_maxrss * 1024
+            else:
+                process.wait()
+                cpu_time, memory = time.perf_counter() - start, 0
+        finally:
+            killer.cancel()
+        wall_time = time.perf_counter() - start
+
+    if wall_time >= task.timeout:
+        return 'TL'  # Процесс снят по таймауту
+    if memory > task.memory_limit * 1024 * 1024:
+        return 'ML'
+    if cpu_time > task.time_limit:
+        return 'TL'
+    if process.returncode != 0:
+        return 'RE'
+    return 'OK'
+
+@profiler.profiled('execute')
 def execute_one_test(task):
     """ Запуск решения на одном тесте """
     global cfg
+    if invoker is None:
+        return execute_with_subprocess(task)
     answer = 'FL'
 
     files = [c_char_p(fn.encode('utf-8'))
@@ -237,7 +490,8 @@ def execute_one_test(task):
     time_limit = c_uint(int(1000 * task.time_limit))
 
     try:
-        invoker.console(*files, byref(memory_limit), byref(time_limit))
+        with profiler.phase('invoker.console'):
+            invoker.console(*files, byref(memory_limit), byref(time_limit))
 
         if memory_limit.value > task.memory_limit * 1024 * 1024:
             answer = 'ML'
@@ -257,84 +511,608 @@ def execute_one_test(task):
         answer = 'TL'  # Time Limit Exceeded
     return answer
 
+def make_task(taskname=None, task_dir=None):
+    """ Задача с лимитом памяти из task.json каталога задачи, если он там задан """
+    global cfg
+    task = PatchedTask(taskname or cfg['taskname'], task_dir or cfg['workdir'])
+    config = load_json(task.config_file, {})
+    if 'memory_limit' in config:
+        task.memory_limit = float(config['memory_limit'])
+    return task
+
+def prefetch_generated_tests(tests):
+    """ Фоновая генерация тестов в порядке проверки, пока решение работает на предыдущих """
+    global cfg
+    generated = [cfg['generated'][test] for test in tests if test in cfg.get('generated', {})]
+    if generated:
+        cfg['test_cache'].prefetch(generated, cfg['generate_jobs'])
+
+def locate_test(test, store, suite_key='.'):
+    """ Пути к входному файлу и файлу ответа теста """
+    global cfg
+    if test in cfg.get('generated', {}):
+        try:
+            return cfg['test_cache'].get(cfg['generated'][test])
+        except (subprocess.SubprocessError, OSError) as e:
+            logging.error(f'Не удалось сгенерировать тест {test}: {e}')
+            raise ArbiterError('FL') from None
+    try:
+        return test_files(pathjoin(cfg['testdir'], suite_key), test, store)
+    except FileNotFoundError:
+        test_file = pathjoin(cfg['testdir'], suite_key, test)
+        return test_file, test_file + '.a'
+
+def stage_test(test, store, destination):
+    """ Копирование входного файла теста на место входного файла решения
+    Сгенерированный тест, вытесненный из кэша другим процессом, генерируется повторно
+    :return: (входной файл, файл ответа, хэш входного файла)
+    """
+    for attempt in range(2):
+        test_file, answer_file = locate_test(test, store)
+        try:
+            return test_file, answer_file, copy_and_hash(test_file, destination)
+        except FileNotFoundError:
+            if test not in cfg.get('generated', {}) or attempt:
+                logging.error(f'Не найден входной файл теста {test}: {test_file}')
+                raise ArbiterError('FL') from None
+            logging.warning(f'Сгенерированный тест {test} вытеснен из кэша, генерирую заново')
+
+def execute_with_retries(task, test, test_file):
+    """ Запуск решения на тесте, превышение времени перепроверяется еще двумя запусками """
+    execution_verdict = execute_one_test(task)
+    logging.info(f'Запускаю тест {test}:')
+    if execution_verdict == 'TL':
+        for i in range(2):
+            logging.info('Got timelimit, run again')
+            # Права не копируются: файлы тестов могут быть ссылками на файлы хранилища только для чтения
+            shutil.copyfile(test_file, task.input_file)
+            execution_verdict = execute_one_test(task)
+            if execution_verdict != 'TL':
+                break
+    if execution_verdict != 'OK':
+        logging.info(f'  Программа завершилась некорректно')
+    return execution_verdict
+
+def log_verdict(test, verdict, output):
+    if output:
+        try:
+            logging.info(f'  Вывод проверки теста {test}: ' + output.decode('cp1251').rstrip())
+        except:
+            logging.info(f'  Вывод проверки теста {test}: ' + output.rstrip())
+    logging.info(f'  Вердикт на тесте {test}: {verdict}')
+
+def run_tests_serial(task, tests, store, results):
+    """ Последовательная проверка: подготовка, запуск и проверка каждого теста по очереди """
+    verdict = 'OK'
+    for test in tests:
+        with profiler.phase(test, group=True):
+            with profiler.phase('stage'):
+                test_file, answer_file, input_hash = stage_test(test, store, task.input_file)
+            execution_verdict = execute_with_retries(task, test, test_file)
+            if execution_verdict != 'OK':
+                verdict, output = execution_verdict, None
+            else:
+                logging.info(f'  Программа отработала, запускаю проверку результатов:')
+                verdict, output = check_answer(task, answer_file, input_hash)
+            results[test] = verdict
+            cleanup(task)
+            with profiler.phase('log'):
+                log_verdict(test, verdict, output)
+
+        if verdict != 'OK':
+            break
+        task.time_limit, task.timeout = 1.5, 3
+    return verdict
+
+def run_tests_pipelined(task, tests, store, results):
+    """ Конвейерная проверка
+    Решение по-прежнему запускается строго по одному, но проверка ответа на тесте i,
+    подготовка теста i+1 и запись в журнал идут во время запуска решения на следующем тесте.
+    Результаты учитываются по порядку тестов, вердикт определяет первая ошибка.
+    """
+    global cfg
+    checkdir = tempfile.mkdtemp(prefix='.check', dir=cfg['workdir'])
+    stager = ThreadPoolExecutor(max_workers=1)
+    checker = ThreadPoolExecutor(max_workers=1)
+    pending = deque()  # (тест, проверка) в порядке тестов
+
+    def stage(test, stack):
+        with profiler.background(stack + [test]), profiler.phase('stage'):
+            return stage_test(test, store, STAGE_FILENAME)
+
+    failed = []  # Тест с первой ошибкой проверки, после него проверки не выполняются
+
+    def check(stack, test, *args):
+        """ Проверка ответа и запись ее результата в журнал в потоке чекера
+        Проверки идут в одном потоке по порядку тестов, поэтому журнал остается упорядоченным
+        """
+        with profiler.background(stack):
+            if failed:
+                return None, None
+            verdict, output = check_answer(*args)
+            with profiler.phase('log'):
+                log_verdict(test, verdict, output)
+            if verdict != 'OK':
+                failed.append(test)
+            return verdict, output
+
+    def reconcile(wait):
+        """ Учет завершенных проверок по порядку тестов до первой ошибки """
+        while pending and (wait or pending[0][1].done()):
+            test, future = pending.popleft()
+            verdict, output = future.result()
+            results[test] = verdict
+            if verdict != 'OK':
+                return verdict
+        return 'OK'
+
+    verdict = 'OK'
+    try:
+        staged = stager.submit(stage, tests[0], profiler.current())
+        for i, test in enumerate(tests):
+            with profiler.phase(test, group=True):
+                with profiler.phase('wait_stage'):
+                    test_file, answer_file, input_hash = staged.result()
+                os.replace(STAGE_FILENAME, task.input_file)
+                if i + 1 < len(tests):
+                    staged = stager.submit(stage, tests[i + 1], profiler.current()[:-1])
+
+                execution_verdict = execute_with_retries(task, test, test_file)
+                if execution_verdict != 'OK':
+                    cleanup(task)
+                    with profiler.phase('wait_check'):
+                        verdict = reconcile(wait=True)
+                    if verdict == 'OK':
+                        verdict = results[test] = execution_verdict
+                        log_verdict(test, verdict, None)
+                    break
+
+                # Вывод уводим из-под следующего запуска, чекер получает исходный файл теста
+                output_file = pathjoin(checkdir, test + '.out')
+                if isfile(task.output_file):
+                    os.replace(task.output_file, output_file)
+                cleanup(task)
+                pending.append((test, checker.submit(check, profiler.current(), test, task, answer_file,
+                                                           input_hash, test_file, output_file)))
+            task.time_limit, task.timeout = 1.5, 3
+
+            verdict = reconcile(wait=False)
+            if verdict != 'OK':
+                break
+        else:
+            with profiler.phase('wait_check'):
+                verdict = reconcile(wait=True)
+    finally:
+        stager.shutdown(wait=True)
+        checker.shutdown(wait=True)
+        if isfile(STAGE_FILENAME):
+            os.remove(STAGE_FILENAME)
+        shutil.rmtree(checkdir, ignore_errors=True)
+    return verdict
+
+@profiler.profiled('run_tests')
 def run_tests():
     """ Проверка решения """
     global cfg
     answer = {
         'datetime': datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
-        'language': 'VisualCppLang',
-        'compilation': 'FL',
+        'language': cfg['language'],
+        'compilation': cfg['compilation'],
         'results': OrderedDict()
     }
 
-    task = PatchedTask(cfg['taskname'], cfg['workdir'])
-    task.input_file
+    task = make_task()
 
     logging.info('Переходим в рабочий каталог ' + cfg['workdir'])
     os.chdir(cfg['workdir'])
 
     # Проверка на тестах
-    results = []
-    testmask = pathjoin(cfg['testdir'], '??')
-    tests = sorted([basename(fn) for fn in glob.glob(testmask)])
+    tests = list_tests(cfg['testdir'])
     logging.debug('НАЙДЕНЫ ТЕСТЫ: ' + ' '.join(tests))
 
     suite_key = '.' # на будущее мб папки для позадач
     answer['results'][suite_key] = OrderedDict()
+    store = BlobStore.find(cfg['testdir'])
 
-    first_run_timelimit = 3
-    task.time_limit, task.timeout = first_run_timelimit, 2*first_run_timelimit
-    for test in tests:
-        test_file = pathjoin(cfg['testdir'], suite_key, test)
-        shutil.copy(test_file, task.input_file)
-        execution_verdict = execute_one_test(task)
-        logging.info(f'Запускаю тест {test}:')
-        if execution_verdict == 'TL':
-            for i in range(2):
-                logging.info('Got timelimit, run again')
-                shutil.copy(test_file, task.input_file)
-                execution_verdict = execute_one_test(task)
-                if execution_verdict != 'TL':
+    task.time_limit, task.timeout = FIRST_RUN_TIMELIMIT, 2*FIRST_RUN_TIMELIMIT
+    run = run_tests_pipelined if cfg['pipeline'] else run_tests_serial
+    prefetch_generated_tests(tests)
+    try:
+        with cfg['scheduler'].admit(task.memory_limit, cfg['taskname']):
+            verdict = run(task, tests, store, answer['results'][suite_key])
+    finally:
+        if cfg.get('test_cache'):
+            cfg['test_cache'].close()
+    if verdict != 'OK':
+        logging.info('Останавливаю тестирование.')
+        raise ArbiterError(verdict)
+    return verdict
+
+def program_command(program):
+    """ Командная строка запуска программы, исходный текст предварительно компилируется """
+    language = detect_language(program)
+    if language is None:
+        return [program]
+    ok, result = build_program(language, program)
+    if not ok:
+        logging.error(f'Ошибка компиляции {program}:')
+        logging.error(result.decode('utf-8', 'replace'))
+        raise ArbiterError('FL')
+    return language.command(result)
+
+def check_stress_programs():
+    """ Проверка наличия генератора и эталонного решения для стресс-тестирования """
+    global cfg
+    programs = []
+    for program in cfg['stress']:
+        program = abspath(pathjoin(cfg['workdir'], program))
+        if not isfile(program):
+            logging.error(f'Не найдена программа для стресс-тестирования: {program}')
+            raise ArbiterError('FL')
+        programs.append(program_command(program))
+    cfg['generator'], cfg['reference'] = programs
+    logging.debug(f'ГЕНЕРАТОР: {cfg["generator"]}, ЭТАЛОННОЕ РЕШЕНИЕ: {cfg["reference"]}')
+
+def run_isolated(task, command, input_file, directory):
+    """ Запуск программы в отдельном каталоге, чтобы параллельные запуски не мешали друг другу
+    Вход подается и в файл task.input_file, и на stdin; выводом считается task.output_file,
+    а если он пуст - stdout
+    :return: (вердикт запуска, файл с выводом программы)
+    """
+    os.mkdir(directory)
+    shutil.copy(input_file, pathjoin(directory, task.input_file))
+    stdout_file = pathjoin(directory, 'stdout')
+    try:
+        with open(input_file, 'rb') as stdin, open(stdout_file, 'wb') as stdout:
+            subprocess.run(command, cwd=directory, stdin=stdin, stdout=stdout,
+                           stderr=subprocess.DEVNULL, timeout=task.timeout, check=True)
+    except subprocess.TimeoutExpired:
+        return 'TL', None
+    except (subprocess.CalledProcessError, OSError):
+        return 'RE', None
+    output_file = pathjoin(directory, task.output_file)
+    if isfile(output_file) and os.stat(output_file).st_size > 0:
+        return 'OK', output_file
+    return 'OK', stdout_file
+
+def stress_one_test(task, seed):
+    """ Один тест стресс-тестирования после допуска по памяти """
+    global cfg
+    with cfg['scheduler'].admit(task.memory_limit, f'{cfg["taskname"]}:{seed}'):
+        return stress_one_test_admitted(task, seed)
+
+def stress_one_test_admitted(task, seed):
+    """ Один тест стресс-тестирования: генерация, эталонное решение, решение и проверка
+    :return: (номер, вердикт, каталог с файлами теста)
+    """
+    global cfg
+    directory = tempfile.mkdtemp(prefix=f'.stress{seed}-', dir=cfg['workdir'])
+    input_file = pathjoin(directory, 'input')
+    try:
+        with open(input_file, 'wb') as f:
+            subprocess.run(cfg['generator'] + [str(seed)], cwd=directory, stdout=f,
+                           timeout=task.timeout, check=True)
+    except (subprocess.SubprocessError, OSError) as e:
+        logging.error(f'Генератор не отработал на тесте {seed}: {e}')
+        return seed, 'FL', directory
+    verdict, answer_file = run_isolated(task, cfg['reference'], input_file, pathjoin(directory, 'reference'))
+    if verdict != 'OK':
+        logging.error(f'Эталонное решение не отработало на тесте {seed}: {verdict}')
+        return seed, 'FL', directory
+    shutil.copy(answer_file, input_file + '.a')
+    verdict, output_file = run_isolated(task, cfg['solution_cmd'], input_file, pathjoin(directory, 'solution'))
+    if verdict == 'OK':
+        verdict, output = task.check(input_file + '.a', input_file, output_file)
+    if verdict == 'OK':
+        shutil.rmtree(directory, ignore_errors=True)
+    return seed, verdict, directory
+
+def save_failed_test(directory):
+    """ Сохранение теста в каталог тестов под следующим свободным номером
+    Арбитр видит только двузначные имена тестов, поэтому после 99 занимается первый
+    свободный номер, а если свободных нет - тест не сохраняется
+    :return: имя сохраненного теста или None
+    """
+    global cfg
+    tests = set(list_tests(cfg['testdir']))
+    numbers = [int(test) for test in tests if test.isdigit()]
+    free = ['%02d' % number for number in range(max(numbers, default=0) + 1, 100)]
+    free = free or ['%02d' % number for number in range(1, 100) if '%02d' % number not in tests]
+    if not free:
+        return None
+    test = free[0]
+    test_file = pathjoin(cfg['testdir'], test)
+    shutil.copy(pathjoin(directory, 'input'), test_file)
+    shutil.copy(pathjoin(directory, 'input.a'), test_file + '.a')
+    return test
+
+@profiler.profiled('run_stress')
+def run_stress():
+    """ Стресс-тестирование: решение сравнивается с эталонным на сгенерированных тестах
+    Тесты выполняются параллельно, после первого расхождения новые тесты не запускаются,
+    из найденных расхождений в каталог тестов сохраняется наименьший тест
+    """
+    global cfg
+    task = make_task()
+    os.chdir(cfg['workdir'])
+    logging.info(f'Стресс-тестирование: {cfg["stress_count"]} тестов, {cfg["jobs"]} потоков')
+
+    seeds = iter(range(1, cfg['stress_count'] + 1))
+    failures, done = [], 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=cfg['jobs']) as pool:
+        running = set()
+        while True:
+            while not failures and len(running) < 2 * cfg['jobs']:
+                seed = next(seeds, None)
+                if seed is None:
                     break
-        if execution_verdict != 'OK':
-            logging.info(f'  Программа завершилась некорректно')
-            verdict, output = execution_verdict, None
+                running.add(pool.submit(stress_one_test, task, seed))
+            if not running:
+                break
+            finished, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                seed, verdict, directory = future.result()
+                done += 1
+                if verdict != 'OK':
+                    logging.info(f'  Тест {seed}: {verdict}')
+                    failures.append((seed, verdict, directory))
+    elapsed = time.perf_counter() - start
+    logging.info(f'Выполнено тестов: {done} за {elapsed:.2f} с, {done / elapsed:.1f} тестов/с')
+
+    if not failures:
+        return 'OK'
+    # Отказ генератора или эталонного решения (FL) сохранять бессмысленно
+    candidates = [failure for failure in failures if failure[1] != 'FL'] or failures
+    size = lambda failure: (os.stat(pathjoin(failure[2], 'input')).st_size, failure[0])
+    seed, verdict, directory = min(candidates, key=size)
+    if verdict != 'FL':
+        test = save_failed_test(directory)
+        if test is None:
+            logging.error(f'Тест {seed} с вердиктом {verdict} не сохранен: заняты все номера тестов 01-99')
         else:
-            logging.info(f'  Программа отработала, запускаю проверку результатов:')
-            verdict, output = task.check(answer_file=test_file + '.a')
-        answer['results'][suite_key][test] = verdict
-        cleanup(task)
-        if output:
-            try:
-                logging.info('  Вывод проверки: ' + output.decode('cp1251').rstrip())
-            except:
-                logging.info('  Вывод проверки: ' + output.rstrip())
-        logging.info(f'  Вердикт: {verdict}')
+            logging.info(f'Тест {seed} с вердиктом {verdict} сохранен в каталог тестов как {test}')
+    for failure in failures:
+        shutil.rmtree(failure[2], ignore_errors=True)
+    raise ArbiterError(verdict)
 
-        if verdict != 'OK':
-            logging.info('Останавливаю тестирование.')
-            raise ArbiterError(verdict)
-        task.time_limit, task.timeout = 1.5, 3
+def check_token():
+    """ Распределенная проверка возможна только с общим ключом координатора и рабочих процессов """
+    global cfg
+    if not cfg['token']:
+        logging.error(f'Для распределенной проверки нужен общий ключ: --token или {TOKEN_ENVIRONMENT}')
+        raise ArbiterError('FL')
+
+@profiler.profiled('run_coordinator')
+def run_coordinator():
+    """ Распределенная проверка: задания из групп тестов выполняют рабочие процессы,
+    вердикт по первой ошибке собирается координатором
+    """
+    global cfg
+    store = BlobStore.find(cfg['testdir'])
+    blobs, tests = {}, []
+    prefetch_generated_tests(list_tests(cfg['testdir']))
+    try:
+        for test in list_tests(cfg['testdir']):
+            digests = []
+            for filename in locate_test(test, store):
+                digest = cached_file_hash(filename)
+                blobs[digest] = filename
+                digests.append(digest)
+            tests.append([test] + digests)
+        job = {'task': cfg['taskname'], 'language': cfg['language'], 'memory_limit': make_task().memory_limit,
+               'first_test': tests[0][0]}
+        for name in ('solution', 'checker'):
+            job[name] = cached_file_hash(cfg[name])
+            blobs[job[name]] = cfg[name]
+    except OSError as e:
+        logging.error(f'Не удалось подготовить файлы для рабочих процессов: {e}')
+        raise ArbiterError('FL') from None
+
+    coordinator = Coordinator(job, tests, blobs, cfg['shard_size'], cfg['token'], cfg['shard_retries'])
+    host, port = coordinator.serve(parse_address(cfg['coordinator']))
+    logging.info(f'Координатор ждет рабочие процессы на {host}:{port}, заданий: {len(coordinator.shards)}')
+    try:
+        verdict = coordinator.wait(cfg['cluster_timeout'] or None)
+    finally:
+        coordinator.shutdown()
+    if verdict is None:
+        logging.error(f'Распределенная проверка не завершилась за {cfg["cluster_timeout"]} с')
+        verdict = 'FL'
+    if verdict != 'OK':
+        logging.info('Останавливаю тестирование.')
+        raise ArbiterError(verdict)
     return verdict
 
+class ReportedResults(OrderedDict):
+    """ Результаты задания рабочего процесса, каждый вердикт сразу отправляется координатору """
+
+    def __init__(self, connection, shard):
+        super().__init__()
+        self.connection = connection
+        self.shard = shard
+
+    def __setitem__(self, test, verdict):
+        super().__setitem__(test, verdict)
+        self.connection.request({'type': 'result', 'shard': self.shard, 'test': test, 'verdict': verdict})
+
+def prepare_executable(store, digest, filename):
+    """ Исполняемая копия файла из хранилища (файлы хранилища только для чтения) """
+    shutil.copy(store.path(digest), filename)
+    os.chmod(filename, 0o755)
+    return filename
+
+@profiler.profiled('run_worker_job')
+def run_worker_job(connection, store, job):
+    """ Выполнение задания координатора: загрузка недостающих файлов и проверка группы тестов """
+    global cfg
+    os.makedirs(store.root, exist_ok=True)
+    digests = [job['solution'], job['checker']] + [digest for test in job['tests'] for digest in test[1:]]
+    for digest in digests:
+        if digest not in store:
+            download = pathjoin(store.root, f'{digest}.{os.getpid()}.download')
+            connection.fetch(digest, download)
+            store.put(download, digest)
+            os.remove(download)
+        store.touch(digest)
+    removed, freed = store.trim(cfg['worker_store_size'] * 1024 * 1024, set(digests))
+    if removed:
+        logging.debug(f'Из хранилища рабочего процесса удалено файлов: {removed} ({freed} байт)')
+
+    jobdir = tempfile.mkdtemp(prefix=f'.job{job["shard"]}-', dir=cfg['cachedir'])
+    testdir = pathjoin(jobdir, 'test')
+    os.mkdir(testdir)
+    save_json({name: [input_hash, answer_hash] for name, input_hash, answer_hash in job['tests']},
+              pathjoin(testdir, MANIFEST_FILENAME))
+    exe = '.exe' if sys.platform == 'win32' else ''
+    language = LANGUAGES.get(job['language'])
+    solution = pathjoin(jobdir, language.artifact if language else 'solution' + exe)
+    cfg.update(workdir=jobdir, testdir=testdir, taskname=job['task'],
+               solution=prepare_executable(store, job['solution'], solution),
+               checker=prepare_executable(store, job['checker'], pathjoin(jobdir, 'checker' + exe)),
+               checker_hash=job['checker'])
+    cfg['solution_cmd'] = language.command(cfg['solution']) if language else [cfg['solution']]
+    check_invoker_loads()
+
+    task = PatchedTask(job['task'], jobdir)
+    task.memory_limit = job['memory_limit']
+    # Увеличенный лимит только на первом тесте всей посылки, как при проверке на одной машине
+    if job['tests'][0][0] == job['first_test']:
+        task.time_limit, task.timeout = FIRST_RUN_TIMELIMIT, 2*FIRST_RUN_TIMELIMIT
+    else:
+        task.time_limit, task.timeout = 1.5, 3
+    results = ReportedResults(connection, job['shard'])
+    run = run_tests_pipelined if cfg['pipeline'] else run_tests_serial
+    os.chdir(jobdir)
+    try:
+        with cfg['scheduler'].admit(task.memory_limit, f'{job["task"]}:{job["shard"]}'):
+            run(task, [test[0] for test in job['tests']], store, results)
+    finally:
+        os.chdir(cfg['cachedir'])
+        shutil.rmtree(jobdir, ignore_errors=True)
+    connection.request({'type': 'finished', 'shard': job['shard']})
+
+def run_worker_shard(connection, store, job):
+    """ Выполнение задания с сообщением координатору об отказе на рабочем процессе
+    Ошибки соединения передаются дальше, остальные ошибки - отказ этого задания
+    """
+    try:
+        run_worker_job(connection, store, job)
+    except ConnectionError:
+        raise
+    except ArbiterError as e:
+        reason = f'вердикт {e.args[0]}'
+    except (OSError, subprocess.SubprocessError) as e:
+        reason = f'{type(e).__name__}: {e}'
+    else:
+        return
+    logging.error(f'Задание {job["shard"]} не выполнено: {reason}')
+    connection.request({'type': 'failed', 'shard': job['shard'], 'message': reason})
+
+def run_worker():
+    """ Рабочий процесс распределенной проверки: подключается к координатору,
+    забирает задания и возвращает вердикты, после завершения посылки ждет следующую
+    """
+    global cfg
+    address = parse_address(cfg['worker'], 'localhost')
+    store = BlobStore(pathjoin(cfg['cachedir'], BLOBS_DIRNAME))
+    os.makedirs(cfg['cachedir'], exist_ok=True)
+    setup_verdict_cache()
+    idle_since = time.monotonic()
+    while not cfg['idle_exit'] or time.monotonic() - idle_since < cfg['idle_exit']:
+        try:
+            connection = Connection(address, timeout=5)
+        except OSError:
+            time.sleep(1)
+            continue
+        try:
+            connection.register(cfg['token'], socket.gethostname())
+            logging.info(f'Подключен к координатору {address[0]}:{address[1]}')
+            while True:
+                job = connection.request({'type': 'pull'})
+                if job['type'] == 'job':
+                    run_worker_shard(connection, store, job)
+                elif job['type'] == 'done':
+                    time.sleep(1)
+                    break
+                else:
+                    time.sleep(0.2)
+        except ConnectionError as e:
+            logging.warning(f'Соединение с координатором потеряно: {e}')
+            time.sleep(1)
+        finally:
+            connection.close()
+        idle_since = time.monotonic()
+
+@profiler.profiled('arbiter')
+def grade():
+    """ Проверка окружения и тестирование решения """
+    global cfg
+    check_dirs()
+    setup_generated_tests()
+    check_tests_exist()
+    cfg['known_checkers'] = get_known_checkers()
+    check_checker_exists()
+    setup_verdict_cache()
+    check_solution_exists()
+    compile_solution()
+    if cfg['stress']:
+        check_stress_programs()
+        return run_stress()
+    if cfg['coordinator']:
+        check_token()
+        return run_coordinator()
+    check_invoker_loads()
+
+    logging.info(f'=== Тестирование задачи {cfg["taskname"]} начато ===')
+    return run_tests()
+
+def save_profile(cprofile=None):
+    """ Запись замеров времени рядом с файлом результата:
+    таблица этапов (.profile.txt), стеки для flamegraph (.folded) и профиль cProfile (.pstats)
+    """
+    global cfg
+    summary = profiler.summary()
+    logging.info('Время этапов проверки:\n' + summary)
+    base = pathjoin(cfg['resultsdir'], cfg['taskname'])
+    try:
+        open(base + '.profile.txt', 'w', encoding='utf-8').write(summary)
+        open(base + '.folded', 'w', encoding='utf-8').write(profiler.collapsed())
+        if cprofile:
+            cprofile.dump_stats(base + '.pstats')
+    except OSError as e:
+        logging.error(f'Не удалось записать результаты профилирования: {e}')
+
 if __name__ == '__main__':
     original_dir = os.getcwd()
+    cprofile = None
     try:
         setup_logging()
         cfg = read_arguments()
         cfg['checktoolsdir'] = os.path.split(abspath(__loader__.path))[0]
         cfg['taskname'] = re.sub('[^A-Za-z0-9_.]', '' , basename(abspath(cfg['workdir'])))
-
-        check_dirs()
-        cfg['known_checkers'] = get_known_checkers()
-        check_checker_exists()
-        check_solution_exists()
-        check_invoker_loads()
-
-        logging.info(f'=== Тестирование задачи {cfg["taskname"]} начато ===')
-        result = run_tests()
+        cfg['cachedir'] = abspath(cfg['cachedir'] or pathjoin(cfg['checktoolsdir'], CACHE_DIRNAME))
+        profiler.enabled = cfg['profile'] is not None
+        setup_scheduler()
+        if cfg['worker']:
+            check_token()
+            run_worker()
+            sys.exit(0)
+        if cfg['profile'] == 'cprofile':
+            cprofile = cProfile.Profile()
+            result = cprofile.runcall(grade)
+        else:
+            result = grade()
     except ArbiterError as e:
         result = e.args[0]
+    if cfg.get('profile'):
+        save_profile(cprofile)
+    if cfg.get('scheduler'):
+        logging.info(cfg['scheduler'].report())
+    if cfg.get('verdict_cache'):
+        cache = cfg['verdict_cache']
+        logging.debug(f'Кэш вердиктов: попаданий {cache.hits}, промахов {cache.misses}')
+        cache.close()
     try:
         logging.info(f'=== Тестирование задачи {cfg["taskname"]} завершено, ВЕРДИКТ: {result} ===')
         open(pathjoin(cfg['resultsdir'], cfg['taskname']+'.res'), 'w').write(result)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+""" Дедупликация тестов задач в хранилище, адресуемом по содержимому """
+
+import os, sys
+from os.path import abspath, dirname, join as pathjoin, isdir
+from argparse import ArgumentParser
+
+from multimeter.helpers import load_tests
+from multimeter._storage import BlobStore, BLOBS_DIR, load_manifest, find_manifests
+
+
+def read_arguments():
+    """ Установка параметров командной строки """
+    parser = ArgumentParser(description='Хранилище тестов задач по программированию')
+    parser.add_argument('-b', '--blobs', default=None, type=str,
+                        help=f'каталог хранилища, по умолчанию ближайший {BLOBS_DIR} '
+                             'вверх от корневого каталога либо новый в нем')
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('import', help='перенести тесты из каталогов задач в хранилище')
+    command.add_argument('root', type=str, help='корневой каталог с задачами')
+    command.add_argument('--replace', action='store_true',
+                         help='удалять файлы тестов, оставляя их только в хранилище, '
+                              'по умолчанию файлы заменяются жесткими ссылками')
+    command = commands.add_parser('gc', help='удалить из хранилища неиспользуемые файлы')
+    command.add_argument('root', type=str, help='корневой каталог с задачами')
+    return vars(parser.parse_args())
+
+
+def import_tests(store, root, replace=False):
+    """ Перенос в хранилище тестов из всех каталогов дерева """
+    total = 0
+    for path, dirs, files in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        if not load_tests(path):
+            continue
+        count = store.import_dir(path, replace)
+        if count:
+            print(f'{path}: {count} файл(ов)')
+        total += count
+    print(f'Перенесено файлов: {total}')
+
+
+def collect_garbage(store, root):
+    """ Удаление из хранилища файлов, на которые нет ссылок из манифестов
+    Хранилище может быть общим для нескольких деревьев задач, поэтому манифесты
+    ищутся во всем каталоге, содержащем хранилище, а не только в корневом каталоге
+    """
+    references = set()
+    roots = [dirname(store.root)]
+    if not (root + os.sep).startswith(roots[0].rstrip(os.sep) + os.sep):
+        roots.append(root)
+    for top in roots:
+        for path in find_manifests(top):
+            for digests in load_manifest(path).values():
+                references.update(digests)
+    removed, freed = store.collect_garbage(references)
+    print(f'Удалено файлов: {removed}, освобождено {freed} байт')
+
+
+if __name__ == '__main__':
+    args = read_arguments()
+    root = abspath(args['root'])
+    if not isdir(root):
+        print(f'Каталог "{root}" не найден')
+        sys.exit(-1)
+    if args['blobs']:
+        store = BlobStore(args['blobs'])
+    else:
+        store = BlobStore.find(root) or BlobStore(pathjoin(root, BLOBS_DIR))
+    if args['command'] == 'import':
+        import_tests(store, root, args['replace'])
+    else:
+        collect_garbage(store, root)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+""" Проверка распределенного режима арбитра на localhost
+Создает задачу во временном каталоге, запускает координатор и несколько рабочих процессов
+и сравнивает вердикты с обычной проверкой на одной машине. Работает там, где решение
+запускается без invoker.dll (не Windows).
+"""
+
+import os, sys, socket, secrets, shutil, tempfile, subprocess
+from os.path import abspath, dirname, join as pathjoin
+from argparse import ArgumentParser
+
+ARBITER = pathjoin(dirname(abspath(__file__)), 'arbiter.py')
+
+CHECKER = '''#!/usr/bin/env python3
+import sys
+inp, out, ans = sys.argv[1:]
+ok = open(out).read().split() == open(ans).read().split()
+print('ok' if ok else 'wrong')
+sys.exit(0 if ok else 1)
+'''
+
+SOLUTIONS = {
+    'ok.py': 'a, b = map(int, input().split())\nprint(a + b)\n',
+    'wa.py': 'a, b = map(int, input().split())\nprint(a + b + (a == 7))\n',
+    # Тест 04 начинает второе задание: лимит времени на нем тот же, что и без распределения
+    'tl.py': 'import time\na, b = map(int, input().split())\nwhile a == 4 and time.process_time() < 2: pass\n'
+             'print(a + b)\n',
+}
+
+
+def read_arguments():
+    parser = ArgumentParser(description='Проверка распределенного режима арбитра на localhost')
+    parser.add_argument('-n', '--workers', default=2, type=int, help='количество рабочих процессов')
+    parser.add_argument('--tests', default=12, type=int, help='количество тестов задачи')
+    parser.add_argument('--shard-size', default=3, type=int, help='количество тестов в задании')
+    return vars(parser.parse_args())
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def make_task(root, tests):
+    """ Задача a+b с чекером и решениями """
+    taskdir = pathjoin(root, 'lab1')
+    os.makedirs(pathjoin(taskdir, 'test'))
+    checker = pathjoin(taskdir, 'test', 'check.exe')
+    open(checker, 'w').write(CHECKER)
+    os.chmod(checker, 0o755)
+    for i in range(1, tests + 1):
+        open(pathjoin(taskdir, 'test', f'{i:02d}'), 'w').write(f'{i} 5\n')
+        open(pathjoin(taskdir, 'test', f'{i:02d}.a'), 'w').write(f'{i + 5}\n')
+    for name, text in SOLUTIONS.items():
+        open(pathjoin(taskdir, name), 'w').write(text)
+    return taskdir
+
+
+def grade(taskdir, solution, *args):
+    """ Вердикт арбитра """
+    subprocess.run([sys.executable, ARBITER, '-s', solution, *args], cwd=taskdir,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return open(pathjoin(taskdir, 'lab1.res')).read().strip()
+
+
+if __name__ == '__main__':
+    args = read_arguments()
+    root = tempfile.mkdtemp(prefix='multimeter-cluster-')
+    taskdir = make_task(root, args['tests'])
+    port = free_port()
+    os.environ['MULTIMETER_TOKEN'] = secrets.token_hex(16)  # Общий ключ наследуют все запуски
+    workers = []
+    try:
+        for i in range(args['workers']):
+            workdir = pathjoin(root, f'worker{i}')
+            os.mkdir(workdir)
+            workers.append(subprocess.Popen(
+                [sys.executable, ARBITER, '--worker', f'127.0.0.1:{port}', '-c', pathjoin(workdir, 'cache')],
+                cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        failed = 0
+        for solution in SOLUTIONS:
+            expected = grade(taskdir, solution, '-c', pathjoin(root, 'cache'))
+            actual = grade(taskdir, solution, '-c', pathjoin(root, 'cache'), '--coordinator', str(port),
+                           '--shard-size', str(args['shard_size']), '--cluster-timeout', '120')
+            status = 'OK' if expected == actual else 'РАСХОЖДЕНИЕ'
+            print(f'{solution}: на одной машине {expected}, распределенно {actual} - {status}')
+            failed += expected != actual
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.wait()
+        shutil.rmtree(root, ignore_errors=True)
+    sys.exit(1 if failed else 0)
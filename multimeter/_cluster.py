@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+import os
+import hmac
+import json
+import time
+import socket
+import secrets
+import hashlib
+import logging
+import threading
+import socketserver
+from collections import OrderedDict, deque
+
+from .helpers import file_hash
+
+CHUNK_SIZE = 1 << 20
+
+
+def send_message(wfile, message):
+    """ Отправка сообщения: одна строка JSON """
+    wfile.write(json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n')
+    wfile.flush()
+
+
+def receive_message(rfile):
+    line = rfile.readline()
+    if not line:
+        raise ConnectionError('Соединение закрыто')
+    return json.loads(line.decode('utf-8'))
+
+
+def send_file(wfile, filename):
+    """ Отправка файла: заголовок с размером, затем содержимое как есть """
+    send_message(wfile, {'type': 'blob', 'size': os.stat(filename).st_size})
+    with open(filename, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            wfile.write(chunk)
+    wfile.flush()
+
+
+def parse_address(address, default_host='127.0.0.1'):
+    """ Адрес в виде [хост:]порт """
+    host, _, port = address.rpartition(':')
+    return host or default_host, int(port)
+
+
+def proof(token, nonce):
+    """ Доказательство знания общего ключа без его передачи по сети """
+    return hmac.new(token.encode('utf-8'), nonce.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+class Connection:
+    """ Соединение рабочего процесса с координатором """
+
+    def __init__(self, address, timeout=None):
+        self.socket = socket.create_connection(address, timeout=timeout)
+        self.socket.settimeout(None)
+        self.rfile = self.socket.makefile('rb')
+        self.wfile = self.socket.makefile('wb')
+
+    def request(self, message):
+        """ Обмен сообщениями; любая сетевая ошибка превращается в ConnectionError,
+        чтобы ее можно было отличить от ошибок на самом рабочем процессе
+        """
+        try:
+            send_message(self.wfile, message)
+            return receive_message(self.rfile)
+        except ConnectionError:
+            raise
+        except OSError as error:
+            raise ConnectionError(error) from error
+
+    def register(self, token, name):
+        """ Взаимная проверка общего ключа с координатором
+        Рабочий процесс отвечает на случайный вызов координатора и сам проверяет
+        ответ координатора, чтобы не запускать программы, присланные кем угодно
+        """
+        challenge = self.request({'type': 'hello'})
+        if challenge.get('type') != 'challenge':
+            raise ConnectionError('Координатор не прислал вызов')
+        nonce = secrets.token_hex(16)
+        reply = self.request({'type': 'register', 'worker': name, 'nonce': nonce,
+                              'proof': proof(token, challenge['nonce'])})
+        if reply.get('type') != 'ok' or not hmac.compare_digest(reply.get('proof', ''), proof(token, nonce)):
+            raise ConnectionError('Координатор не подтвердил общий ключ')
+
+    def fetch(self, digest, filename):
+        """ Загрузка файла с координатора по хэшу с проверкой содержимого """
+        reply = self.request({'type': 'blob', 'hash': digest})
+        if reply.get('type') != 'blob':
+            raise ConnectionError('Координатор не выдал файл {}'.format(digest))
+        remaining = reply['size']
+        with open(filename, 'wb') as f:
+            while remaining:
+                try:
+                    chunk = self.rfile.read(min(remaining, CHUNK_SIZE))
+                except OSError as error:
+                    raise ConnectionError(error) from error
+                if not chunk:
+                    raise ConnectionError('Соединение закрыто')
+                f.write(chunk)
+                remaining -= len(chunk)
+        if file_hash(filename) != digest:
+            raise ConnectionError('Файл {} поврежден при передаче'.format(digest))
+
+    def close(self):
+        for f in (self.rfile, self.wfile, self.socket):
+            try:
+                f.close()
+            except OSError:
+                pass
+
+
+class Coordinator:
+    """ Координатор распределенной проверки одной посылки
+    Тесты делятся на группы (задания), рабочие процессы забирают задания,
+    загружают недостающие файлы по хэшам и присылают вердикты по каждому тесту.
+    Вердикт посылки - первая по порядку тестов ошибка, как при проверке на одной машине:
+    он известен, как только пришли результаты всех тестов до нее.
+    Задания отключившегося рабочего процесса возвращаются в очередь
+    ограниченное число раз, после чего считаются отказом проверки (FL).
+    Рабочий процесс допускается только после проверки общего ключа и получает
+    лишь файлы посылки и тестов выданных ему заданий.
+    """
+
+    def __init__(self, job, tests, blobs, shard_size, token, retries=2):
+        """
+        :param job: общие для всех заданий параметры запуска
+        :param tests: список [имя теста, хэш входа, хэш ответа] в порядке проверки
+        :param blobs: словарь хэш -> путь к файлу, которые можно выдавать рабочим
+        :param shard_size: количество тестов в задании
+        :param token: общий ключ координатора и рабочих процессов
+        :param retries: сколько раз задание возвращается в очередь, прежде чем
+            его тесты получат вердикт FL
+        """
+        self.job = job
+        self.token = token
+        self.challenges = {}  # рабочий процесс -> вызов при подключении
+        self.tests = tests
+        self.blobs = blobs
+        self.shards = OrderedDict((i, tests[start:start + shard_size])
+                                  for i, start in enumerate(range(0, len(tests), shard_size)))
+        self.queue = deque(self.shards)
+        self.retries = retries
+        self.failures = {}  # задание -> количество прерванных попыток
+        self.assigned = {}  # задание -> рабочий процесс
+        self.finished = set()
+        self.results = {}
+        self.workers = set()
+        self.verdict = None
+        self.condition = threading.Condition()
+        self.server = None
+
+    def decide(self):
+        """ Вердикт, если он уже определен, иначе None """
+        for name, _, _ in self.tests:
+            verdict = self.results.get(name)
+            if verdict is None:
+                return None
+            if verdict != 'OK':
+                return verdict
+        return 'OK'
+
+    def handle(self, message, worker):
+        kind = message.get('type')
+        with self.condition:
+            if kind == 'hello':
+                self.challenges[worker] = secrets.token_hex(16)
+                return {'type': 'challenge', 'nonce': self.challenges[worker]}
+            if kind == 'register':
+                challenge = self.challenges.pop(worker, None)
+                if challenge is None or not hmac.compare_digest(str(message.get('proof')),
+                                                                proof(self.token, challenge)):
+                    logging.warning('Рабочий процесс {} не подтвердил общий ключ'.format(worker))
+                    return {'type': 'error', 'message': 'Неверный ключ'}
+                self.workers.add(worker)
+                logging.info('Подключен рабочий процесс {} ({})'.format(worker, message.get('worker')))
+                return {'type': 'ok', 'proof': proof(self.token, str(message.get('nonce')))}
+            if worker not in self.workers:
+                return {'type': 'error', 'message': 'Рабочий процесс не зарегистрирован'}
+            if kind == 'pull':
+                if self.verdict is not None:
+                    return {'type': 'done'}
+                if not self.queue:
+                    return {'type': 'wait'}
+                shard = self.queue.popleft()
+                self.assigned[shard] = worker
+                logging.info('Задание {} ({} тестов) выдано {}'.format(shard, len(self.shards[shard]), worker))
+                return dict(self.job, type='job', shard=shard, tests=self.shards[shard])
+            if kind == 'result':
+                if self.assigned.get(message['shard']) == worker:
+                    self.results[message['test']] = message['verdict']
+                    logging.info('  Тест {}: {} ({})'.format(message['test'], message['verdict'], worker))
+                    self.update()
+                return {'type': 'ok'}
+            if kind == 'failed':
+                if self.assigned.get(message['shard']) == worker:
+                    del self.assigned[message['shard']]
+                    self.retry(message['shard'], '{}: {}'.format(worker, message.get('message')))
+                return {'type': 'ok'}
+            if kind == 'finished':
+                shard = message['shard']
+                if self.assigned.get(shard) == worker:
+                    del self.assigned[shard]
+                    self.finished.add(shard)
+                    # Рабочий процесс прерывает задание на первой ошибке,
+                    # а непроверенные тесты без ошибки в задании считаются отказом
+                    verdicts = [self.results.get(name) for name, _, _ in self.shards[shard]]
+                    if all(verdict in ('OK', None) for verdict in verdicts):
+                        for name, _, _ in self.shards[shard]:
+                            self.results.setdefault(name, 'FL')
+                    self.update()
+                return {'type': 'ok'}
+        return {'type': 'error', 'message': 'Неизвестное сообщение: {}'.format(kind)}
+
+    def blob(self, worker, digest):
+        """ Путь к файлу для рабочего процесса: файлы посылки и тестов выданных ему заданий """
+        with self.condition:
+            if worker not in self.workers:
+                return None
+            allowed = digest in (self.job.get('solution'), self.job.get('checker')) or any(
+                digest in test[1:] for shard, owner in self.assigned.items() if owner == worker
+                for test in self.shards[shard])
+            return self.blobs.get(digest) if allowed else None
+
+    def update(self):
+        verdict = self.decide()
+        if verdict is not None and self.verdict is None:
+            self.verdict = verdict
+            self.condition.notify_all()
+
+    def disconnect(self, worker):
+        with self.condition:
+            self.workers.discard(worker)
+            self.challenges.pop(worker, None)
+            for shard, owner in list(self.assigned.items()):
+                if owner == worker:
+                    del self.assigned[shard]
+                    self.retry(shard, '{} отключился'.format(worker))
+
+    def retry(self, shard, reason):
+        """ Возврат прерванного задания в очередь, после исчерпания попыток - отказ FL """
+        self.failures[shard] = self.failures.get(shard, 0) + 1
+        if self.failures[shard] > self.retries:
+            logging.error('Задание {} не выполнено за {} попыток: {}'.format(shard, self.failures[shard], reason))
+            self.finished.add(shard)
+            for name, _, _ in self.shards[shard]:
+                self.results.setdefault(name, 'FL')
+            self.update()
+        else:
+            self.queue.appendleft(shard)
+            logging.warning('Задание {} возвращено в очередь: {}'.format(shard, reason))
+
+    def serve(self, address):
+        """ Запуск сервера координатора в отдельном потоке """
+        coordinator = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                worker = '{}:{}'.format(*self.client_address[:2])
+                try:
+                    while True:
+                        message = receive_message(self.rfile)
+                        if message.get('type') == 'blob':
+                            filename = coordinator.blob(worker, message.get('hash'))
+                            if filename is None:
+                                send_message(self.wfile, {'type': 'error', 'message': 'Нет файла'})
+                            else:
+                                send_file(self.wfile, filename)
+                            continue
+                        reply = coordinator.handle(message, worker)
+                        send_message(self.wfile, reply)
+                        if reply['type'] == 'error' and worker not in coordinator.workers:
+                            break
+                except (ConnectionError, OSError, ValueError):
+                    pass
+                finally:
+                    coordinator.disconnect(worker)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer(address, Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server.server_address
+
+    def wait(self, timeout=None):
+        """ Ожидание вердикта посылки """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while self.verdict is None:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            return self.verdict
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join, isdir, isfile
+
+from ._verdicts import cached_file_hash
+
+try:
+    import fcntl
+except ImportError:  # Windows: от вытеснения защищены только тесты текущего процесса
+    fcntl = None
+
+DEFAULT_CACHE_SIZE = 1024  # Мб
+GENERATE_TIMEOUT = 600  # Предельное время генерации теста или ответа, секунды
+
+
+class GeneratedTest:
+    """ Тест, заданный генератором и его аргументами, ответ дает эталонное решение """
+
+    def __init__(self, name, generator, args, reference):
+        self.name = name
+        self.generator = generator
+        self.args = [str(arg) for arg in args]
+        self.reference = reference
+
+    @property
+    def key(self):
+        """ Ключ кэша: хэши генератора и эталонного решения, аргументы """
+        digest = hashlib.sha256()
+        for part in (cached_file_hash(self.generator), cached_file_hash(self.reference), json.dumps(self.args)):
+            digest.update(part.encode('utf-8') + b'\0')
+        return digest.hexdigest()
+
+
+def load_generated(suite, task_dir, reference):
+    """ Сгенерированные тесты подзадачи из task.json
+    Формат: "generated": {"50": {"generator": "gen.py", "args": [1000000, 42]}, ...}
+    :param suite: описание подзадачи
+    :param task_dir: каталог задачи, относительно него заданы генераторы
+    :param reference: путь к эталонному решению
+    :return: словарь имя теста -> GeneratedTest
+    :raise ValueError: описание тестов задано неверно
+    """
+    if not isinstance(suite, dict):
+        raise ValueError('описание подзадачи должно быть объектом')
+    generated = suite.get('generated', {})
+    if not isinstance(generated, dict):
+        raise ValueError('"generated" должно быть объектом "имя теста": описание')
+    tests = OrderedDict()
+    for name, spec in generated.items():
+        if not isinstance(spec, dict) or not isinstance(spec.get('generator'), str):
+            raise ValueError('у теста {} не задан генератор "generator"'.format(name))
+        if not isinstance(spec.get('args', []), list):
+            raise ValueError('аргументы "args" теста {} должны быть списком'.format(name))
+        generator = join(task_dir, spec['generator'])
+        tests[name] = GeneratedTest(name, generator, spec.get('args', []), reference)
+    return tests
+
+
+class TestCache:
+    """ Кэш сгенерированных тестов ограниченного размера
+    Тест и ответ материализуются при первом обращении, параллельно для нескольких тестов.
+    При превышении размера удаляются давно не использованные тесты
+    (время использования - время модификации каталога теста).
+    Используемые тесты не вытесняются: в этом процессе они запоминаются,
+    а от других процессов защищены разделяемой блокировкой каталога теста.
+    Фоновая генерация идет только после допуска по памяти, как запуск решения;
+    тест, который нужен прямо сейчас, генерируется в вызывающем потоке.
+    """
+
+    def __init__(self, root, max_size=DEFAULT_CACHE_SIZE, prepare=None,
+                 input_file='input.txt', output_file='output.txt', admit=None):
+        """
+        :param root: каталог кэша
+        :param max_size: размер кэша в Мб
+        :param prepare: функция, возвращающая командную строку запуска программы по ее пути
+        :param input_file: имя входного файла задачи
+        :param output_file: имя выходного файла задачи
+        :param admit: функция, возвращающая контекстный менеджер допуска фоновой генерации по памяти
+        """
+        self.root = root
+        self.max_size = max_size * 1024 * 1024
+        self.prepare = prepare or (lambda program: [program])
+        self.input_file = input_file
+        self.output_file = output_file
+        self.admit = admit or nullcontext
+        self.in_use = set()  # Тесты текущей проверки не вытесняются
+        self.handles = {}  # ключ -> дескриптор каталога теста с разделяемой блокировкой
+        self.key_locks = {}
+        self.lock = threading.Lock()
+        self.closed = False
+        self.pool = None
+        self.futures = {}
+
+    def path(self, key):
+        return join(self.root, key[:2], key)
+
+    def files(self, key):
+        return join(self.path(key), 'input'), join(self.path(key), 'input.a')
+
+    def get(self, test):
+        """ Пути к входному файлу и файлу ответа теста, тест генерируется при необходимости
+        Если фоновая генерация теста уже идет, ожидается ее завершение
+        """
+        return self._get(test)
+
+    def prefetch(self, tests, jobs=1):
+        """ Фоновая материализация тестов в jobs потоков """
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=jobs)
+        for test in tests:
+            # Ключ по содержимому, а не имя: тесты разных подзадач могут называться одинаково
+            if test.key not in self.futures:
+                self.futures[test.key] = self.pool.submit(self._prefetch, test)
+
+    def close(self):
+        self.closed = True
+        if self.pool is not None:
+            for future in self.futures.values():
+                future.cancel()
+            self.pool.shutdown(wait=True)
+            self.pool = None
+        self.futures = {}
+        with self.lock:
+            for handle in self.handles.values():
+                os.close(handle)
+            self.handles = {}
+            self.in_use = set()
+        self.closed = False
+
+    def _prefetch(self, test):
+        with self.admit():
+            if not self.closed:
+                self._get(test)
+
+    def _get(self, test):
+        key = test.key
+        with self.lock:
+            self.in_use.add(key)
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            generated = False
+            while not self._hold(key):
+                self._generate(test, key)
+                generated = True
+        if generated:
+            self.evict()
+        return self.files(key)
+
+    def _hold(self, key):
+        """ Защита готового теста от вытеснения другими процессами
+        :return: False, если теста нет в кэше
+        """
+        answer_file = self.files(key)[1]
+        if fcntl is None or key in self.handles:
+            if not isfile(answer_file):
+                return False
+            os.utime(self.path(key))
+            return True
+        try:
+            handle = os.open(self.path(key), os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        fcntl.flock(handle, fcntl.LOCK_SH)
+        if not isfile(answer_file):
+            os.close(handle)  # Тест вытеснен, пока ожидалась блокировка
+            return False
+        os.utime(self.path(key))
+        with self.lock:
+            self.handles[key] = handle
+        return True
+
+    def _generate(self, test, key):
+        logging.debug('Генерация теста {}: {} {}'.format(test.name, test.generator, ' '.join(test.args)))
+        os.makedirs(join(self.root, key[:2]), exist_ok=True)
+        work_dir = tempfile.mkdtemp(prefix=key + '.', dir=join(self.root, key[:2]))
+        try:
+            input_file = join(work_dir, 'input')
+            with open(input_file, 'wb') as stdout:
+                subprocess.run(self.prepare(test.generator) + test.args, cwd=work_dir, stdout=stdout,
+                               timeout=GENERATE_TIMEOUT, check=True)
+            run_dir = join(work_dir, 'reference')
+            os.mkdir(run_dir)
+            shutil.copy(input_file, join(run_dir, self.input_file))
+            stdout_file = join(run_dir, 'stdout')
+            with open(input_file, 'rb') as stdin, open(stdout_file, 'wb') as stdout:
+                subprocess.run(self.prepare(test.reference), cwd=run_dir, stdin=stdin, stdout=stdout,
+                               timeout=GENERATE_TIMEOUT, check=True)
+            output_file = join(run_dir, self.output_file)
+            if not (isfile(output_file) and os.stat(output_file).st_size > 0):
+                output_file = stdout_file
+            os.replace(output_file, input_file + '.a')
+            shutil.rmtree(run_dir)
+            try:
+                os.rename(work_dir, self.path(key))
+            except OSError:
+                # Тот же тест уже сгенерировал параллельный процесс
+                shutil.rmtree(work_dir, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            raise
+
+    def entries(self):
+        """ Тесты кэша: [(время использования, размер, ключ)] """
+        result = []
+        if not isdir(self.root):
+            return result
+        for prefix in os.listdir(self.root):
+            for key in os.listdir(join(self.root, prefix)):
+                path = join(self.root, prefix, key)
+                if '.' in key or not isdir(path):
+                    continue
+                try:
+                    size = sum(os.stat(join(path, name)).st_size for name in os.listdir(path))
+                    result.append((os.stat(path).st_mtime, size, key))
+                except OSError:
+                    pass
+        return result
+
+    def evict(self):
+        """ Удаление давно не использованных тестов, пока кэш больше допустимого """
+        with self.lock:
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            for used, size, key in entries:
+                if total <= self.max_size:
+                    break
+                if key in self.in_use or not self._remove(key):
+                    continue
+                total -= size
+                logging.debug('Сгенерированный тест {} вытеснен из кэша'.format(key))
+
+    def _remove(self, key):
+        """ Удаление теста, если его не используют другие процессы """
+        if fcntl is None:
+            shutil.rmtree(self.path(key), ignore_errors=True)
+            return True
+        try:
+            handle = os.open(self.path(key), os.O_RDONLY)
+        except FileNotFoundError:
+            return True  # Уже удален другим процессом
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False  # Тест используется
+        else:
+            shutil.rmtree(self.path(key), ignore_errors=True)
+            return True
+        finally:
+            os.close(handle)
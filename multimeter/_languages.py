@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import shutil
+import hashlib
+import logging
+import tempfile
+import subprocess
+from collections import OrderedDict
+from os.path import join, isdir, isfile, splitext
+
+COMPILE_TIMEOUT = 60  # Предельное время компиляции в секундах
+
+
+class Language:
+    """ Язык программирования: компиляция исходного текста и запуск результата """
+    name = ''
+    extensions = ()
+    compiler = ''  # Компилятор или интерпретатор
+    flags = []  # Ключи компиляции перед исходным файлом
+    libs = []  # Ключи компиляции после исходного файла
+    artifact = 'solution'  # Имя результата компиляции
+
+    _version = None
+
+    def available(self):
+        return shutil.which(self.compiler) is not None
+
+    def version(self):
+        """ Версия компилятора, входит в ключ кэша сборок """
+        if self._version is None:
+            try:
+                output = subprocess.check_output([self.compiler, '--version'], stderr=subprocess.STDOUT)
+                self._version = output.decode('utf-8', 'replace').strip()
+            except (subprocess.SubprocessError, OSError):
+                self._version = ''
+        return self._version
+
+    def build_key(self, source):
+        """ Ключ кэша сборок: язык, версия компилятора, ключи компиляции и исходный текст """
+        digest = hashlib.sha256()
+        for part in [self.name, self.version()] + self.flags + self.libs:
+            digest.update(part.encode('utf-8') + b'\0')
+        with open(source, 'rb') as f:
+            digest.update(f.read())
+        return digest.hexdigest()
+
+    def compile(self, source, build_dir):
+        """ Компиляция исходного файла в каталог сборки
+        Если компилятор не удалось запустить или он не уложился во время,
+        исключение OSError или subprocess.TimeoutExpired передается вызывающему
+        :return: (успех компиляции, сообщения компилятора)
+        """
+        command = [self.compiler] + self.flags + [source, '-o', join(build_dir, self.artifact)] + self.libs
+        process = subprocess.run(command, cwd=build_dir, stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT, timeout=COMPILE_TIMEOUT)
+        return process.returncode == 0, process.stdout
+
+    def command(self, artifact):
+        """ Командная строка запуска результата компиляции """
+        return [artifact]
+
+
+class GnuCLang(Language):
+    name = 'GnuCLang'
+    extensions = ('.c',)
+    compiler = 'gcc'
+    flags = ['-O2', '-std=c11']
+    libs = ['-lm']
+
+
+class GnuCppLang(Language):
+    name = 'GnuCppLang'
+    extensions = ('.cpp', '.cc', '.cxx')
+    compiler = 'g++'
+    flags = ['-O2', '-std=c++17']
+
+
+class ClangCLang(GnuCLang):
+    name = 'ClangCLang'
+    compiler = 'clang'
+
+
+class ClangCppLang(GnuCppLang):
+    name = 'ClangCppLang'
+    compiler = 'clang++'
+
+
+class PythonLang(Language):
+    """ Интерпретируемый язык: компиляция - только проверка синтаксиса """
+    name = 'PythonLang'
+    extensions = ('.py',)
+    compiler = sys.executable
+    artifact = 'solution.py'
+
+    def compile(self, source, build_dir):
+        artifact = join(build_dir, self.artifact)
+        shutil.copy(source, artifact)
+        process = subprocess.run([self.compiler, '-m', 'py_compile', artifact], cwd=build_dir,
+                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=COMPILE_TIMEOUT)
+        return process.returncode == 0, process.stdout
+
+    def command(self, artifact):
+        return [self.compiler, artifact]
+
+
+# Для каждого расширения выбирается первый доступный язык
+LANGUAGES = OrderedDict((language.name, language) for language in (
+    GnuCLang(), GnuCppLang(), ClangCLang(), ClangCppLang(), PythonLang(),
+))
+
+
+def detect_language(source, name=None):
+    """ Язык исходного файла: заданный явно либо по расширению
+    :return: язык или None, если файл не является исходным текстом
+    """
+    if name:
+        return LANGUAGES[name]
+    extension = splitext(source)[1].lower()
+    candidates = [language for language in LANGUAGES.values() if extension in language.extensions]
+    for language in candidates:
+        if language.available():
+            return language
+    return candidates[0] if candidates else None
+
+
+class BuildCache:
+    """ Кэш результатов компиляции, адресуемый по ключу сборки
+    Повторная отправка или перепроверка того же исходного текста тем же компилятором
+    не компилируется заново. Ошибки компиляции тоже запоминаются.
+    """
+    CE_FILENAME = 'CE'  # Сообщения компилятора при ошибке компиляции
+
+    def __init__(self, root):
+        self.root = root
+        self.hits = self.misses = 0
+
+    def build(self, language, source):
+        """ Компиляция с использованием кэша
+        Запоминается только ошибка, которую выдал сам компилятор; отсутствие компилятора
+        и превышение времени компиляции не кэшируются, исключение передается вызывающему
+        :return: (успех компиляции, путь к результату либо сообщения компилятора)
+        """
+        key = language.build_key(source)
+        build_dir = join(self.root, key[:2], key)
+        if not isdir(build_dir):
+            self.misses += 1
+            os.makedirs(join(self.root, key[:2]), exist_ok=True)
+            tmp_dir = tempfile.mkdtemp(prefix=key + '.', dir=join(self.root, key[:2]))
+            try:
+                ok, messages = language.compile(os.path.abspath(source), tmp_dir)
+            except (OSError, subprocess.SubprocessError):
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                raise
+            if not ok:
+                with open(join(tmp_dir, self.CE_FILENAME), 'wb') as f:
+                    f.write(messages or b'')
+            try:
+                os.rename(tmp_dir, build_dir)
+            except OSError:
+                # Ту же сборку уже успел положить в кэш параллельный процесс
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        else:
+            self.hits += 1
+            logging.debug('Сборка {} взята из кэша'.format(key))
+        ce_file = join(build_dir, self.CE_FILENAME)
+        if isfile(ce_file):
+            with open(ce_file, 'rb') as f:
+                return False, f.read()
+        return True, join(build_dir, language.artifact)
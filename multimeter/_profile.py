@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import threading
+from time import perf_counter
+from functools import wraps
+from contextlib import contextmanager
+from collections import OrderedDict
+
+
+class PhaseProfiler:
+    """ Замер времени этапов проверки
+    Этапы вкладываются друг в друга, стек этапов ведется отдельно для каждого потока.
+    Время накапливается по полному пути этапа, например "arbiter;run_tests;01;execute".
+    Этапы, выполняемые в фоновых потоках параллельно с основным, учитываются в отдельном
+    дереве "background;<путь родителя>", чтобы их время не вычиталось из времени родителя.
+    """
+    BACKGROUND = 'background'
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.totals = OrderedDict()  # путь этапа -> [суммарное время, количество вызовов]
+        self.groups = set()  # пути этапов, которые только группируют вложенные (тесты)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def phase(self, name, group=False):
+        """ Замер этапа
+        :param name: имя этапа
+        :param group: этап только группирует вложенные (например, тест) и не выводится в таблице
+        """
+        if not self.enabled:
+            yield
+            return
+        current = self._stack()
+        current.append(name)
+        path = ';'.join(current)
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            current.pop()
+            with self._lock:
+                total = self.totals.setdefault(path, [0.0, 0])
+                total[0] += elapsed
+                total[1] += 1
+                if group:
+                    self.groups.add(path)
+
+    @contextmanager
+    def background(self, stack):
+        """ Этапы фонового потока, выполняемые для родительского этапа stack другого потока """
+        if not self.enabled:
+            yield
+            return
+        current = self._stack()
+        saved = list(current)
+        current[:] = [self.BACKGROUND] + stack
+        try:
+            yield
+        finally:
+            current[:] = saved
+
+    def profiled(self, name):
+        """ Декоратор: замер каждого вызова функции как этапа name """
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.phase(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def current(self):
+        """ Путь текущего этапа для передачи в другой поток """
+        return list(self._stack())
+
+    def self_times(self):
+        """ Собственное время этапов (без вложенных), в секундах """
+        own = OrderedDict((path, total[0]) for path, total in self.totals.items())
+        for path, total in self.totals.items():
+            parent = path.rpartition(';')[0]
+            if parent in own:
+                own[parent] -= total[0]
+        return own
+
+    def summary(self):
+        """ Таблица: этап (без учета имени теста), число вызовов, суммарное и среднее время """
+        phases = OrderedDict()
+        for path, (elapsed, count) in self.totals.items():
+            if path in self.groups:
+                continue
+            name = path.rpartition(';')[2]
+            phase = phases.setdefault(name, [0.0, 0])
+            phase[0] += elapsed
+            phase[1] += count
+        lines = ['{:<24} {:>8} {:>12} {:>12}'.format('этап', 'вызовов', 'всего, мс', 'среднее, мс')]
+        for name, (elapsed, count) in sorted(phases.items(), key=lambda item: -item[1][0]):
+            lines.append('{:<24} {:>8} {:>12.3f} {:>12.3f}'.format(
+                name, count, 1000 * elapsed, 1000 * elapsed / count))
+        return '\n'.join(lines) + '\n'
+
+    def collapsed(self):
+        """ Стеки в свернутом формате flamegraph.pl: "путь время_в_мкс" """
+        return ''.join('{} {}\n'.format(path, max(int(1e6 * elapsed), 0))
+                       for path, elapsed in self.self_times().items())
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from collections import deque
+from os.path import join, isdir
+
+try:
+    import fcntl
+except ImportError:  # Windows: учитываются только запуски текущего процесса
+    fcntl = None
+
+POLL_INTERVAL = 0.5  # Период повторной проверки занятой памяти другими процессами, секунды
+
+
+def physical_memory():
+    """ Объем оперативной памяти машины в Мб или None, если его не удалось узнать """
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MemoryScheduler:
+    """ Допуск одновременных запусков по объявленным лимитам памяти
+    Запуск допускается, если сумма лимитов памяти уже идущих запусков, его лимита
+    и запаса не превышает бюджет; иначе он ждет в очереди (допуск строго по порядку очереди,
+    чтобы запуск с большим лимитом не ждал бесконечно). Одиночный запуск
+    допускается всегда, даже если его лимит больше бюджета.
+    Если задан каталог учета, учитываются и запуски других процессов на этой машине
+    (каждый процесс записывает туда свои резервы, доступ через блокировку файла).
+    """
+
+    def __init__(self, budget, margin=0, ledger_dir=None):
+        """
+        :param budget: бюджет памяти в Мб
+        :param margin: запас в Мб, добавляемый к лимиту каждого запуска
+        :param ledger_dir: каталог учета резервов процессов машины
+        """
+        self.budget = budget
+        self.margin = margin
+        self.ledger_dir = ledger_dir if fcntl is not None else None
+        self.reserved = {}  # идентификатор запуска -> резерв в Мб
+        self.queue = deque()  # идентификаторы ожидающих запусков
+        self.condition = threading.Condition()
+        self._next_id = 0
+        # Статистика
+        self.admitted = 0
+        self.waited = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.peak = 0
+        self._usage = 0.0  # Интеграл занятой (в этом процессе) памяти по времени
+        self._since = self._start = time.monotonic()
+        if self.ledger_dir:
+            os.makedirs(self.ledger_dir, exist_ok=True)
+
+    @contextmanager
+    def admit(self, memory_limit, name=''):
+        """ Выполнение запуска с лимитом памяти memory_limit (Мб) после допуска """
+        ticket = self.acquire(memory_limit, name)
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+    def acquire(self, memory_limit, name=''):
+        need = memory_limit + self.margin
+        start = time.monotonic()
+        logged = False
+        with self.condition:
+            ticket = self._next_id
+            self._next_id += 1
+            self.queue.append(ticket)
+            while True:
+                if self.queue[0] == ticket:
+                    with self._ledger_lock():
+                        used = self._others() + sum(self.reserved.values())
+                        if used == 0 or used + need <= self.budget:
+                            self.queue.popleft()
+                            self._account()
+                            self.reserved[ticket] = need
+                            self._write_ledger()
+                            break
+                else:
+                    used = sum(self.reserved.values())
+                if not logged:
+                    logging.debug('Запуск {} ждет памяти: нужно {} Мб, занято {} из {} Мб'.format(
+                        name, need, used, self.budget))
+                    logged = True
+                self.condition.wait(POLL_INTERVAL if self.ledger_dir else None)
+            waited = time.monotonic() - start
+            self.admitted += 1
+            if logged:
+                self.waited += 1
+                self.wait_time += waited
+                self.max_wait_time = max(self.max_wait_time, waited)
+            self.peak = max(self.peak, used + need)
+            self.condition.notify_all()  # Следующий в очереди может поместиться тоже
+        return ticket
+
+    def release(self, ticket):
+        with self.condition:
+            with self._ledger_lock():
+                self._account()
+                del self.reserved[ticket]
+                self._write_ledger()
+            self.condition.notify_all()
+
+    def _account(self):
+        """ Накопление интеграла занятой памяти до текущего момента """
+        now = time.monotonic()
+        self._usage += sum(self.reserved.values()) * (now - self._since)
+        self._since = now
+
+    @contextmanager
+    def _ledger_lock(self):
+        if not self.ledger_dir:
+            yield
+            return
+        with open(join(self.ledger_dir, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _ledger_file(self):
+        return join(self.ledger_dir, '{}.json'.format(os.getpid()))
+
+    def _others(self):
+        """ Память, зарезервированная другими живыми процессами """
+        if not self.ledger_dir or not isdir(self.ledger_dir):
+            return 0
+        used = 0
+        for filename in os.listdir(self.ledger_dir):
+            pid = filename[:-5]
+            if not filename.endswith('.json') or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            if not pid_alive(int(pid)):
+                os.remove(join(self.ledger_dir, filename))  # Процесс завершился аварийно
+                continue
+            try:
+                with open(join(self.ledger_dir, filename)) as f:
+                    used += json.load(f)
+            except (OSError, ValueError):
+                pass
+        return used
+
+    def _write_ledger(self):
+        if not self.ledger_dir:
+            return
+        reserved = sum(self.reserved.values())
+        if reserved:
+            with open(self._ledger_file(), 'w') as f:
+                json.dump(reserved, f)
+        elif os.path.exists(self._ledger_file()):
+            os.remove(self._ledger_file())
+
+    def report(self):
+        """ Статистика очереди и использования бюджета """
+        with self.condition:
+            self._account()
+            elapsed = max(self._since - self._start, 1e-9)
+            utilization = 100.0 * self._usage / elapsed / self.budget if self.budget else 0.0
+            return ('Допуск по памяти: запусков {}, ждали {} (всего {:.2f} с, максимум {:.2f} с), '
+                    'пик {} из {} Мб, средняя загрузка бюджета {:.1f}%').format(
+                self.admitted, self.waited, self.wait_time, self.max_wait_time,
+                self.peak, self.budget, utilization)
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+import os
+import stat
+import logging
+from os.path import join, isdir, isfile, dirname, abspath
+
+from .helpers import load_json, save_json, file_hash, load_tests, MANIFEST_FILENAME
+
+BLOBS_DIR = '.blobs'  # Каталог хранилища в рабочем каталоге
+
+
+class BlobStore:
+    """ Хранилище тестовых данных, адресуемых по содержимому (sha256) """
+
+    def __init__(self, root):
+        self.root = abspath(root)
+
+    @classmethod
+    def find(cls, directory):
+        """ Поиск хранилища в каталоге или в одном из его родительских каталогов
+        :param directory: каталог, с которого начинается поиск
+        :return: хранилище или None, если его нет
+        """
+        directory = abspath(directory)
+        while True:
+            root = join(directory, BLOBS_DIR)
+            if isdir(root):
+                return cls(root)
+            parent = dirname(directory)
+            if parent == directory:
+                return None
+            directory = parent
+
+    def path(self, digest):
+        return join(self.root, digest[:2], digest[2:])
+
+    def __contains__(self, digest):
+        return isfile(self.path(digest))
+
+    def __iter__(self):
+        """ Перебор хэшей всех файлов хранилища """
+        if not isdir(self.root):
+            return
+        for prefix in sorted(os.listdir(self.root)):
+            subdir = join(self.root, prefix)
+            if len(prefix) != 2 or not isdir(subdir):
+                continue
+            for rest in sorted(os.listdir(subdir)):
+                if not rest.endswith('.tmp'):
+                    yield prefix + rest
+
+    def put(self, filename, digest=None):
+        """ Помещение копии файла в хранилище
+        :param filename: путь к файлу
+        :param digest: хэш файла, если уже известен
+        :return: хэш файла
+        """
+        digest = digest or file_hash(filename)
+        blob = self.path(digest)
+        if not isfile(blob):
+            os.makedirs(dirname(blob), exist_ok=True)
+            tmp = blob + '.%d.tmp' % os.getpid()
+            with open(filename, 'rb') as src, open(tmp, 'wb') as dst:
+                while True:
+                    chunk = src.read(1 << 20)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+            # Файл хранилища только для чтения: его содержимое обязано совпадать с хэшем,
+            # а жесткие ссылки на него из каталогов задач не должны правиться на месте
+            os.chmod(tmp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            os.replace(tmp, blob)
+        return digest
+
+    def link(self, digest, filename):
+        """ Замена файла жесткой ссылкой на файл хранилища
+        :return: True, если ссылку удалось создать
+        """
+        tmp = filename + '.%d.tmp' % os.getpid()
+        try:
+            os.link(self.path(digest), tmp)
+            os.replace(tmp, filename)
+        except OSError as error:
+            logging.debug('Не удалось создать жесткую ссылку на {}: {}'.format(digest, error))
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return False
+        return True
+
+    def remove(self, digest):
+        blob = self.path(digest)
+        os.chmod(blob, stat.S_IRUSR | stat.S_IWUSR)
+        os.remove(blob)
+
+    def touch(self, digest):
+        """ Отметка использования файла: время модификации для вытеснения в trim """
+        os.utime(self.path(digest))
+
+    def trim(self, max_size, keep=()):
+        """ Удаление давно не использованных файлов, пока хранилище больше допустимого
+        Подходит для хранилищ-кэшей, на которые нет ссылок из манифестов (рабочие процессы)
+        :param max_size: размер хранилища в байтах
+        :param keep: хэши, которые удалять нельзя
+        :return: (количество удаленных файлов, освобожденный объем в байтах)
+        """
+        blobs = []
+        for digest in self:
+            try:
+                info = os.stat(self.path(digest))
+            except FileNotFoundError:
+                continue
+            blobs.append((info.st_mtime, info.st_size, digest))
+        total = sum(size for _, size, _ in blobs)
+        removed, freed = 0, 0
+        for _, size, digest in sorted(blobs):
+            if total <= max_size:
+                break
+            if digest in keep:
+                continue
+            try:
+                self.remove(digest)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+            freed += size
+        return removed, freed
+
+    def import_dir(self, directory, replace=False):
+        """ Перенос тестов каталога в хранилище
+        Файлы тестов заменяются жесткими ссылками на файлы хранилища,
+        либо (replace=True) удаляются, и тогда тесты остаются только в манифесте
+        :param directory: каталог с тестами
+        :param replace: удалять ли файлы тестов из каталога
+        :return: количество перенесенных файлов
+        """
+        manifest = load_manifest(directory)
+        imported = []
+        for test in load_tests(directory):
+            filenames = (join(directory, test), join(directory, test + '.a'))
+            if not (isfile(filenames[0]) and isfile(filenames[1])):
+                continue  # Тест уже перенесен, остался только в манифесте
+            digests = []
+            for filename in filenames:
+                digest = self.put(filename)
+                digests.append(digest)
+                # Жесткая ссылка защищает файл хранилища от одновременной сборки мусора,
+                # пока на него нет ссылки из манифеста
+                self.link(digest, filename)
+                imported.append(filename)
+            manifest[test] = digests
+        if not manifest:
+            return 0
+        # Файлы тестов удаляются только после записи манифеста, иначе при прерывании
+        # переноса тесты остались бы только в хранилище без ссылок на них
+        save_manifest(directory, manifest)
+        if replace:
+            for filename in imported:
+                os.remove(filename)
+        return len(imported)
+
+    def collect_garbage(self, references):
+        """ Удаление файлов хранилища, на которые нет ссылок
+        Файлы, у которых есть жесткие ссылки из каталогов задач, не удаляются,
+        даже если манифест каталога потерян
+        :param references: множество используемых хэшей
+        :return: (количество удаленных файлов, освобожденный объем в байтах)
+        """
+        removed, freed = 0, 0
+        for digest in list(self):
+            if digest in references:
+                continue
+            info = os.stat(self.path(digest))
+            if info.st_nlink > 1:
+                continue
+            self.remove(digest)
+            removed += 1
+            freed += info.st_size
+        return removed, freed
+
+
+def load_manifest(directory):
+    """ Чтение манифеста тестов каталога, если он есть """
+    return load_json(MANIFEST_FILENAME, {}, directory)
+
+
+def save_manifest(directory, manifest):
+    """ Атомарная запись манифеста тестов каталога """
+    filename = join(directory, MANIFEST_FILENAME)
+    tmp = filename + '.%d.tmp' % os.getpid()
+    save_json(manifest, tmp)
+    os.replace(tmp, filename)
+
+
+def find_manifests(root):
+    """ Поиск всех манифестов тестов в дереве каталогов """
+    for path, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if d != BLOBS_DIR]
+        if MANIFEST_FILENAME in files:
+            yield path
+
+
+def test_files(directory, test, store=None):
+    """ Пути к входному файлу и файлу ответа теста
+    Если файлов теста нет в каталоге, они берутся из хранилища по хэшам из манифеста
+    :param directory: каталог с тестами
+    :param test: имя теста
+    :param store: хранилище, по умолчанию ищется вверх от каталога
+    :return: (входной файл, файл ответа)
+    """
+    input_file, answer_file = join(directory, test), join(directory, test + '.a')
+    if isfile(input_file) and isfile(answer_file):
+        return input_file, answer_file
+    digests = load_manifest(directory).get(test)
+    store = store or BlobStore.find(directory)
+    if not digests or store is None:
+        raise FileNotFoundError(input_file)
+    return store.path(digests[0]), store.path(digests[1])
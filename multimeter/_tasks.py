@@ -3,9 +3,12 @@ import sys
 import subprocess
 from collections import OrderedDict
 from os import listdir, stat
-from os.path import isdir, join, isfile
+from os.path import isdir, join, isfile, dirname
 
 from .helpers import load_json, save_json, validate_code, check_or_create_dir, load_tests
+from ._storage import BlobStore, test_files
+from ._languages import BuildCache, detect_language
+from ._generated import TestCache, load_generated
 
 
 class Tasks:
@@ -147,9 +150,30 @@ class TestSuite:
         self.results = data['results']
         self.test_score = data.get('test_score', 0)
         self.total_score = data.get('total_score', 0)
-        self.tests = load_tests(self.ts_dir)
+        try:
+            self.generated = load_generated(data, task.task_dir, task.reference)
+        except ValueError as e:
+            raise Exception('Generated tests of test suite {} for task {} are invalid: {} !!!'.format(
+                code, task.code, e))
+        tests = set(load_tests(self.ts_dir))
+        if tests & set(self.generated):
+            raise Exception('Generated tests {} of test suite {} duplicate test files !!!'.format(
+                ', '.join(sorted(tests & set(self.generated))), code))
+        self.tests = sorted(tests | set(self.generated))
         self.depends = data.get('depends', self.depends)
 
+    def test_files(self, test):
+        """ Пути к входному файлу и файлу ответа теста
+        (в каталоге подзадачи, в хранилище или в кэше сгенерированных тестов)
+        """
+        if test in self.generated:
+            return self.task.generated_cache.get(self.generated[test])
+        return test_files(self.ts_dir, test, self.task.blob_store)
+
+    def prefetch(self, jobs=1):
+        """ Фоновая генерация тестов подзадачи """
+        self.task.generated_cache.prefetch(self.generated.values(), jobs)
+
 
 class Task:
     # Важные атрибуты
@@ -163,12 +187,16 @@ class Task:
     memory_limit = 256  # Лимит по количеству памяти в Мб, при превышении - вердикт ML
     input_file = 'input.txt'  # Имя выходного файла
     output_file = 'output.txt'  # Имя выходного файла
+    reference = ''  # Эталонное решение, дает ответы на сгенерированные тесты
 
     # Атрибуты заполняемые из файлов
     statement = ''  # Условия задачи
     preliminary = []  # Список примеров для предварительной проверки решения
     test_suites = OrderedDict()  # Словарь подзадач, подзадача - это список тестов
 
+    _blob_store = None
+    _generated_cache = None
+
     def __init__(self, code, task_dir):
         """
         Создание задачи по каталогу
@@ -210,6 +238,36 @@ class Task:
     def test_suites_dir(self):
         return join(self.task_dir, 'tests')
 
+    @property
+    def cache_dir(self):
+        return join(dirname(self.task_dir), '.cache')
+
+    @property
+    def generated_cache(self):
+        """ Кэш сгенерированных тестов, общий для задач рабочего каталога """
+        if self._generated_cache is None:
+            self._generated_cache = TestCache(join(self.cache_dir, 'generated'), prepare=self.prepare_program,
+                                              input_file=self.input_file, output_file=self.output_file)
+        return self._generated_cache
+
+    def prepare_program(self, program):
+        """ Командная строка запуска генератора или эталонного решения, исходный текст компилируется """
+        language = detect_language(program)
+        if language is None:
+            return [program]
+        ok, result = BuildCache(join(self.cache_dir, 'builds')).build(language, program)
+        if not ok:
+            raise Exception('Program {} for task {} is not compiled !!!\n{}'.format(
+                program, self.code, result.decode('utf-8', 'replace')))
+        return language.command(result)
+
+    @property
+    def blob_store(self):
+        """ Хранилище тестов, общее для задач рабочего каталога """
+        if self._blob_store is None:
+            self._blob_store = BlobStore.find(self.task_dir)
+        return self._blob_store
+
     def load(self):
         """ Читаем описание задачи из конфигурационных файлов """
 
@@ -234,6 +292,9 @@ class Task:
         if 'output_file' in config:
             self.output_file = str(config['output_file'])
 
+        if 'reference' in config:
+            self.reference = join(self.task_dir, str(config['reference']))
+
         if 'test_suites' in config:
             tss_from_file = config['test_suites']
             if isinstance(tss_from_file, OrderedDict):
@@ -291,11 +352,17 @@ class Task:
         """
         if suite_code is None:
             test_name = "Preliminary test {}".format(test)
-            input_file = join(self.preliminary_dir, test)
+            test_dir = self.preliminary_dir
         else:
             test_name = "Test {} in {}".format(test, suite_code)
-            input_file = join(self.test_suites_dir, suite_code, test)
-        answer_file = input_file + '.a'
+            test_dir = join(self.test_suites_dir, suite_code)
+        try:
+            if suite_code is None:
+                input_file, answer_file = test_files(test_dir, test, self.blob_store)
+            else:
+                input_file, answer_file = self.test_suites[suite_code].test_files(test)
+        except FileNotFoundError:
+            input_file, answer_file = join(test_dir, test), join(test_dir, test + '.a')
         if not isfile(input_file):
             raise Exception('{} for task {} not found !!!'.format(test_name, self.code))
         if not isfile(answer_file):
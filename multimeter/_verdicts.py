@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import sqlite3
+import logging
+
+from .helpers import file_hash
+
+DEFAULT_CACHE_SIZE = 100000  # Количество хранимых вердиктов
+
+
+class VerdictCache:
+    """ Кэш вердиктов проверяющей программы
+    Ключ - хэши чекера, входного файла, правильного ответа и вывода решения.
+    Вердикты чекера детерминированы, поэтому одинаковый вывод разных решений
+    на одном тесте проверяется только один раз.
+    При переполнении удаляются давно не использованные вердикты.
+    """
+
+    # Кэшируются только окончательные вердикты чекера, отказ чекера (FL) - нет
+    VERDICTS = ('OK', 'WA')
+
+    def __init__(self, filename, size=DEFAULT_CACHE_SIZE):
+        """
+        :param filename: файл базы SQLite
+        :param size: максимальное количество вердиктов
+        """
+        self.size = size
+        self.hits = self.misses = 0
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        self._db = sqlite3.connect(filename, timeout=30, check_same_thread=False)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS verdicts ('
+                             'key TEXT PRIMARY KEY, verdict TEXT, message BLOB, used REAL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS verdicts_used ON verdicts (used)')
+        self._count = self._db.execute('SELECT COUNT(*) FROM verdicts').fetchone()[0]
+
+    @staticmethod
+    def key(checker_hash, input_hash, answer_hash, output_hash):
+        return ':'.join((checker_hash, input_hash, answer_hash, output_hash))
+
+    def get(self, key):
+        """ Вердикт и сообщение чекера по ключу либо None """
+        row = self._db.execute('SELECT verdict, message FROM verdicts WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        with self._db:
+            self._db.execute('UPDATE verdicts SET used = ? WHERE key = ?', (time.time(), key))
+        return [row[0], row[1]]
+
+    def put(self, key, verdict, message):
+        if verdict not in self.VERDICTS:
+            return
+        with self._db:
+            # Счетчик увеличивается только для новых записей, существующая лишь обновляется
+            inserted = self._db.execute('INSERT OR IGNORE INTO verdicts VALUES (?, ?, ?, ?)',
+                                        (key, verdict, message, time.time())).rowcount
+            if not inserted:
+                self._db.execute('UPDATE verdicts SET verdict = ?, message = ?, used = ? WHERE key = ?',
+                                 (verdict, message, time.time(), key))
+            self._count += inserted
+            if self._count > self.size:
+                self.evict()
+
+    def evict(self):
+        """ Удаление давно не использованных вердиктов, освобождает десятую часть кэша """
+        keep = self.size - self.size // 10
+        self._db.execute('DELETE FROM verdicts WHERE key IN '
+                         '(SELECT key FROM verdicts ORDER BY used LIMIT ?)', (max(self._count - keep, 0),))
+        self._count = self._db.execute('SELECT COUNT(*) FROM verdicts').fetchone()[0]
+        logging.debug('Кэш вердиктов очищен до {} записей'.format(self._count))
+
+    def close(self):
+        self._db.close()
+
+
+_hashes = {}
+
+
+def cached_file_hash(filename):
+    """ Хэш неизменяемого файла (теста, ответа, чекера) с запоминанием
+    Повторно хэш вычисляется только если изменились размер или время модификации
+    """
+    info = os.stat(filename)
+    stamp = (os.path.abspath(filename), info.st_size, info.st_mtime_ns)
+    if stamp not in _hashes:
+        _hashes[stamp] = file_hash(filename)
+    return _hashes[stamp]
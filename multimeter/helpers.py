@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 import codecs
 import collections
+import hashlib
 import json
 import os
 import re
@@ -10,6 +11,7 @@ from os.path import join
 
 ISO_DATETIME = '%Y-%m-%dT%H:%M:%S'
 FAR_FUTURE = '2100-01-01T00:00:00'
+MANIFEST_FILENAME = '.blobs.json'  # Манифест тестов каталога: {тест: [хэш входа, хэш ответа]}
 
 
 def log_setup(work_dir, filename="arbiter.log"):
@@ -133,12 +135,45 @@ def get_value(container, key, required_class, default):
     return default
 
 
+def file_hash(filename):
+    """ Хэш sha256 содержимого файла
+    :param filename: путь к файлу
+    :return: шестнадцатеричная строка хэша
+    """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        while True:
+            chunk = f.read(1 << 20)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def copy_and_hash(src, dst):
+    """ Копирование файла с одновременным вычислением хэша sha256 его содержимого
+    :param src: исходный файл
+    :param dst: файл назначения
+    :return: шестнадцатеричная строка хэша
+    """
+    digest = hashlib.sha256()
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        while True:
+            chunk = fin.read(1 << 20)
+            if not chunk:
+                break
+            digest.update(chunk)
+            fout.write(chunk)
+    return digest.hexdigest()
+
+
 def load_tests(directory):
     """
     Чтение тестов из каталога
     Имя входного файла теста не должно содержать точек
     Каждому входному файлу должен соответствовать выходной файл
     Имя выходного файла получается добавлением суффикса ".a"
+    Тесты, перенесенные в хранилище, перечислены в манифесте каталога
     :param directory: каталог
     :return: список имен файлов
     """
@@ -149,7 +184,8 @@ def load_tests(directory):
     inputs = set(filter(lambda name: '.' not in name, names))
     outputs = filter(lambda name: name.endswith('.a'), names)
     outputs = set(map(lambda name: name[:-2], outputs))
-    return sorted(list(inputs & outputs))  # Stay back! I know kung fu!
+    stored = set(load_json(MANIFEST_FILENAME, {}, directory)) if MANIFEST_FILENAME in names else set()
+    return sorted(list((inputs & outputs) | stored))  # Stay back! I know kung fu!
 
 
 class Singleton(type):